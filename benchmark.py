@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for the Simple Stupid Grammar hotkey pipeline
+Presses the hotkey through CorrectionEngine.submit, like the keyboard hook,
+headlessly with a simulated desktop (clipboard, keystrokes, target
+application) and an injectable model backend, then reports p50/p95/p99 for
+the copy, model, paste and restore phases.
+
+Usage:
+    python benchmark.py                                  # simulated model latency
+    python benchmark.py --backend fake-server            # real genai client against fake_gemini_server.py
+    python benchmark.py --compare benchmark_results/hotkey_20240101-120000.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import threading
+from datetime import datetime
+
+import main
+
+
+SIZE_CLASSES = ("short", "medium", "long")
+PHASES = ("copy", "model", "time_to_first_byte", "paste", "restore", "hotkey_to_paste", "total")
+PERCENTILES = (50, 95, 99)
+RESULTS_DIR = "benchmark_results"
+REGRESSION_THRESHOLD = 0.10  # Flag phases whose p50 or p95 got more than 10% slower...
+REGRESSION_MIN_MS = 1.0  # ...and by at least this much, so sub-millisecond noise isn't flagged
+
+SAMPLE_SENTENCES = [
+    "i think teh report is ready , but we has to check the numbers again.",
+    "Their going to the meeting tomorow and they wants the slides before noon.",
+    "The team have finished the the migration adn the service is stable now.",
+    "we dont know wich version of the library was used in production.",
+    "Each of the developers are responsible for reviewing there own changes.",
+    "The results was better then expected,so we will ship it next week.",
+    "Please make sure that you recieve the confirmation email before you leave.",
+    "It is definately worth to spend more time on testing the edge cases.",
+]
+
+
+def build_corpus(rng):
+    """Built-in corpus: one sentence, one paragraph, and a multi-page document"""
+    def paragraph(sentences):
+        return " ".join(rng.choice(SAMPLE_SENTENCES) for _ in range(sentences))
+
+    return {
+        "short": [rng.choice(SAMPLE_SENTENCES) for _ in range(5)],
+        "medium": [paragraph(6) for _ in range(5)],
+        "long": ["\n\n".join(paragraph(8) for _ in range(12)) for _ in range(3)],
+    }
+
+
+def load_corpus(directory):
+    """Load a corpus from DIR/short/*.txt, DIR/medium/*.txt and DIR/long/*.txt"""
+    corpus = {}
+    for size in SIZE_CLASSES:
+        folder = os.path.join(directory, size)
+        texts = []
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                if name.endswith(".txt"):
+                    with open(os.path.join(folder, name), "r", encoding="utf-8") as f:
+                        texts.append(f.read())
+        if texts:
+            corpus[size] = texts
+    if not corpus:
+        raise SystemExit(f"[ERROR] No .txt files found under {directory}/{{short,medium,long}}")
+    return corpus
+
+
+class SimulatedDesktop:
+    """In-memory clipboard and focused application that answer Ctrl+C / Ctrl+V like a real editor"""
+
+    def __init__(self, copy_latency_ms=(5.0, 40.0), rng=None):
+        self.copy_latency_ms = copy_latency_ms
+        self.rng = rng or random.Random()
+        self.selection = ""
+        self.pasted = []
+        self._clipboard = "previous clipboard contents"
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    # Clipboard interface used by SimpleStupidGrammar
+    def paste(self):
+        with self._lock:
+            return self._clipboard
+
+    def copy(self, text):
+        with self._lock:
+            self._clipboard = text
+            self._sequence += 1
+
+    def sequence_number(self):
+        with self._lock:
+            return self._sequence
+
+    # Keys interface used by SimpleStupidGrammar
+    def send_shortcut(self, key):
+        if key == "c":
+            # Real applications fill the clipboard a little after the keystroke
+            delay = self.rng.uniform(*self.copy_latency_ms) / 1000.0
+            threading.Timer(delay, self.copy, args=(self.selection,)).start()
+        elif key == "v":
+            self.pasted.append(self.paste())
+        return True
+
+    def copy_selection(self, copied):
+        self.send_shortcut("c")
+        return copied()
+
+    def is_pressed(self, hotkey):
+        return False
+
+    def foreground_app(self):
+        return "benchmark-editor"
+
+    def read_selection(self):
+        return None  # Like Windows and macOS: the selection has to be copied
+
+
+class SimulatedModelBackend(main.CorrectionBackend):
+    """Answers with the local rule engine after a lognormal delay that grows with the text length"""
+
+    name = "simulated"
+    model = "simulated-model"
+
+    def __init__(self, base_ms=350.0, per_token_ms=2.0, sigma=0.35, rng=None):
+        self.base_ms = base_ms
+        self.per_token_ms = per_token_ms
+        self.sigma = sigma
+        self.rng = rng or random.Random()
+        self.rules = main.LocalRuleBackend()
+
+    def delay(self, text):
+        median = (self.base_ms + self.per_token_ms * main.estimate_tokens(text)) / 1000.0
+        return self.rng.lognormvariate(0, self.sigma) * median
+
+    async def correct_async(self, text, on_partial=None, on_latency=None):
+        await asyncio.sleep(self.delay(text))
+        return self.rules.correct(text)
+
+    async def correct_sentences_async(self, sentences):
+        await asyncio.sleep(self.delay(" ".join(sentences)))
+        return [self.rules.correct(sentence) for sentence in sentences]
+
+
+class TraceCollector(main.LatencyRecorder):
+    """The app's latency recorder, also handing each finished trace to the benchmark"""
+
+    def __init__(self):
+        super().__init__(log_path=None)
+        self.finished = queue.Queue()
+
+    def record(self, trace):
+        super().record(trace)
+        self.finished.put(trace)
+
+
+def summarize(samples):
+    """Turn {phase: [seconds]} into {phase: {p50, p95, p99, mean, count}} in milliseconds"""
+    summary = {}
+    for phase in PHASES:
+        values = [value * 1000.0 for value in samples.get(phase, [])]
+        if not values:
+            continue
+        summary[phase] = {f"p{pct}": round(main.percentile(values, pct), 3) for pct in PERCENTILES}
+        summary[phase]["mean"] = round(sum(values) / len(values), 3)
+        summary[phase]["count"] = len(values)
+    return summary
+
+
+def make_backend(args, rng, stack):
+    """Create the model backend selected on the command line"""
+    if args.backend == "local":
+        return main.LocalRuleBackend()
+    if args.backend == "simulated":
+        routes = [(SimulatedModelBackend(base_ms=args.model_latency_ms, rng=rng), None)]
+    else:
+        from fake_gemini_server import FakeGeminiServer, LatencyModel
+        server = stack.enter_context(FakeGeminiServer(
+            latency=LatencyModel("lognormal", args.model_latency_ms, 0.35, rng=rng),
+            rng=rng,
+        ))
+        main.GEMINI_BASE_URL = server.base_url
+        client = main.make_gemini_client("benchmark")
+        routes = [(main.GeminiBackend(client, model=model), max_tokens) for model, max_tokens in main.MODELS]
+    if args.adaptive:
+        return main.AdaptiveBackend(routes)
+    return routes[0][0]
+
+
+def run_benchmark(args):
+    """Press the hotkey on every text of every size class and collect phase timings"""
+    rng = random.Random(args.seed)
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(rng)
+    main.CLIPBOARD_RESTORE_DELAY = args.restore_delay
+    desktop = SimulatedDesktop(copy_latency_ms=(args.copy_latency_min_ms, args.copy_latency_max_ms), rng=rng)
+    results = {}
+    errors = {}
+
+    with contextlib.ExitStack() as stack:
+        backend = make_backend(args, rng, stack)
+        quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+        with quiet:
+            app = main.SimpleStupidGrammar(backend=backend, clipboard=desktop, keys=desktop, headless=True)
+        app.latency = collector = TraceCollector()
+        app.engine.start()
+        stack.callback(app.engine.stop)
+
+        for size in SIZE_CLASSES:
+            texts = corpus.get(size)
+            if not texts:
+                continue
+            samples = {phase: [] for phase in PHASES}
+            errors[size] = 0
+            print(f"Running {args.iterations} {size} corrections ({len(texts)} texts)...")
+            for iteration in range(args.iterations):
+                if not args.warm_cache:
+                    app.cache = main.CorrectionCache(directory=None)
+                desktop.selection = texts[iteration % len(texts)]
+                quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+                with quiet:
+                    app.engine.submit()
+                    try:
+                        trace = collector.finished.get(timeout=args.timeout)
+                    except queue.Empty:
+                        trace = None
+                if trace is None or trace.error is not None:
+                    errors[size] += 1
+                    continue
+                durations = trace.durations()
+                for phase in PHASES:
+                    if phase in durations:
+                        samples[phase].append(durations[phase])
+            results[size] = summarize(samples)
+
+    if args.adaptive:
+        print(backend.summary())
+    return {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "iterations": args.iterations,
+            "model_latency_ms": args.model_latency_ms,
+            "copy_latency_ms": [args.copy_latency_min_ms, args.copy_latency_max_ms],
+            "restore_delay": args.restore_delay,
+            "warm_cache": args.warm_cache,
+            "adaptive": args.adaptive,
+            "seed": args.seed,
+        },
+        "results": results,
+        "errors": errors,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def print_report(report):
+    print()
+    print(f"{'size':<8}{'phase':<20}" + "".join(f"{'p' + str(pct) + ' ms':>12}" for pct in PERCENTILES))
+    for size, phases in report["results"].items():
+        for phase, stats in phases.items():
+            print(f"{size:<8}{phase:<20}" + "".join(f"{stats['p' + str(pct)]:>12.1f}" for pct in PERCENTILES))
+    failed = sum(report["errors"].values())
+    if failed:
+        print(f"\n[WARNING] {failed} corrections failed or timed out")
+
+
+def compare(report, baseline_path):
+    """Print p50/p95 changes against a previous result file; return the number of regressions"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nCompared with {baseline_path} ({baseline['metadata'].get('git_commit')}):")
+    for size, phases in report["results"].items():
+        for phase, stats in phases.items():
+            before = baseline.get("results", {}).get(size, {}).get(phase)
+            if not before:
+                continue
+            for key in ("p50", "p95"):
+                if not before.get(key):
+                    continue
+                change = (stats[key] - before[key]) / before[key]
+                flag = ""
+                if change > REGRESSION_THRESHOLD and stats[key] - before[key] >= REGRESSION_MIN_MS:
+                    flag = "  <-- REGRESSION"
+                    regressions += 1
+                print(f"  {size:<8}{phase:<20}{key}: {before[key]:9.1f} -> {stats[key]:9.1f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the F9 -> paste pipeline headlessly")
+    parser.add_argument("--backend", choices=("simulated", "fake-server", "local"), default="simulated")
+    parser.add_argument("--iterations", type=int, default=30, help="Corrections per size class")
+    parser.add_argument("--corpus", help="Directory with short/, medium/ and long/ folders of .txt files")
+    parser.add_argument("--model-latency-ms", type=float, default=350.0)
+    parser.add_argument("--copy-latency-min-ms", type=float, default=5.0)
+    parser.add_argument("--copy-latency-max-ms", type=float, default=40.0)
+    parser.add_argument("--restore-delay", type=float, default=0.0,
+                        help="Override CLIPBOARD_RESTORE_DELAY (the app default only adds a fixed wait)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Route between main.MODELS with adaptive timeouts and hedged requests, like the app")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the correction cache between iterations")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for one correction")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Result file (default: benchmark_results/hotkey_<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous result file to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own output")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"hotkey_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
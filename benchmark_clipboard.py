@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Clipboard microbenchmark for Simple Stupid Grammar
+Times every clipboard operation a correction makes (read, write, change
+counter) through pyperclip and through the in-process clipboard for this
+platform (AppKit on macOS, Xlib on Linux/X11), and prints p50/p95 per
+operation. Your clipboard contents are put back afterwards. The X11 paste
+timing reads a clipboard owned by a second X connection, so it includes the
+round trip to another client instead of the text the app copied itself.
+
+Usage:
+    python benchmark_clipboard.py --iterations 200
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime
+
+import main
+from benchmark import RESULTS_DIR, git_commit
+
+
+OPERATIONS = ("copy", "paste", "sequence_number", "copy+paste")
+
+
+def clipboards():
+    """name -> clipboard object for every backend that works here"""
+    available = {"pyperclip": main.SystemClipboard()}
+    native = main.system_clipboard()
+    if type(native) is not main.SystemClipboard:
+        available[type(native).__name__] = native
+    return available
+
+
+def time_operation(operation, iterations):
+    """Run operation(i) iterations times; return the sorted latencies in ms"""
+    times = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        operation(i)
+        times.append((time.perf_counter() - started) * 1000)
+    return sorted(times)
+
+
+def copy_then_paste(clipboard, text):
+    """Write text and read until it is visible, as replace_selection does before pasting"""
+    clipboard.copy(text)
+    main.wait_until(lambda: clipboard.paste() == text, main.PASTE_READY_TIMEOUT)
+
+
+def other_owner(clipboard, text):
+    """Have another X client own CLIPBOARD, so X11Clipboard.paste() asks it instead of returning its own copy"""
+    if not isinstance(clipboard, main.X11Clipboard):
+        return None
+    owner = main.X11Clipboard()
+    owner.copy(text)
+    if not main.wait_until(lambda: clipboard.paste() == text, 2.0):
+        owner.close()
+        raise RuntimeError("the second X connection never got the clipboard")
+    return owner
+
+
+def measure(clipboard, iterations, text):
+    operations = {
+        "copy": lambda i: clipboard.copy(f"{text} {i}"),
+        "paste": lambda i: clipboard.paste(),
+        "sequence_number": lambda i: clipboard.sequence_number(),
+        "copy+paste": lambda i: copy_then_paste(clipboard, f"{text} #{i}"),
+    }
+    results = {}
+    for name in OPERATIONS:
+        owner = other_owner(clipboard, f"{text} (other client)") if name == "paste" else None
+        try:
+            times = time_operation(operations[name], iterations)
+        finally:
+            if owner:
+                owner.close()
+        results[name] = {
+            "p50_ms": times[len(times) // 2],
+            "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))],
+        }
+    return results
+
+
+def print_report(report):
+    names = list(report["clipboards"])
+    print(f"\n{'operation':<18}" + "".join(f"{name + ' p50':>22}{'p95':>10}" for name in names))
+    for operation in OPERATIONS:
+        row = f"{operation:<18}"
+        for name in names:
+            stats = report["clipboards"][name][operation]
+            row += f"{stats['p50_ms']:19.3f} ms{stats['p95_ms']:7.3f} ms"
+        print(row)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Time clipboard operations with pyperclip and in-process")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--text", default="This are the text that the benchmark copy.")
+    parser.add_argument("--output", help="Where to save the JSON results (default: benchmark_results/)")
+    args = parser.parse_args()
+
+    report = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+        },
+        "clipboards": {},
+    }
+    available = clipboards()
+    original = available["pyperclip"].paste()
+    try:
+        for name, clipboard in available.items():
+            print(f"Running {name}...")
+            report["clipboards"][name] = measure(clipboard, args.iterations, args.text)
+    finally:
+        available["pyperclip"].copy(original)
+        for clipboard in available.values():
+            if hasattr(clipboard, "close"):
+                clipboard.close()
+
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIR, f"clipboard_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Request format benchmark for Simple Stupid Grammar
+Sends the benchmark corpus to Gemini in each request format (instructions in
+front of the text or as a system instruction; JSON or plain-text answers) and
+compares the input/output token counts reported by the API and the latency.
+
+Usage:
+    python benchmark_formats.py                            # against fake_gemini_server.py
+    SSG_API_KEY=... python benchmark_formats.py --live     # against the real API (uses quota)
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+from datetime import datetime
+
+import main
+from benchmark import SIZE_CLASSES, RESULTS_DIR, build_corpus, git_commit, load_corpus
+
+
+# name -> (system instruction, output mode); the first one is the baseline
+FORMATS = {
+    "prompt+json": (False, "json"),
+    "system+json": (True, "json"),
+    "prompt+text": (False, "text"),
+    "system+text": (True, "text"),
+}
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+async def run_format(client, name, corpus, args):
+    """Correct every corpus text in one request format; return (results per size, corrected texts)"""
+    system_instructions, output_mode = FORMATS[name]
+    backend = main.GeminiBackend(
+        client, model=args.model, streaming=not args.no_streaming,
+        output_mode=output_mode, system_instructions=system_instructions,
+    )
+    results = {}
+    outputs = {}
+    for size in SIZE_CLASSES:
+        texts = corpus.get(size)
+        if not texts:
+            continue
+        samples = {"input_tokens": [], "output_tokens": [], "latency_ms": [], "first_token_ms": []}
+        errors = 0
+        for iteration in range(args.iterations):
+            for index, text in enumerate(texts):
+                streams = []
+                try:
+                    corrected = await backend.correct_async(text, on_latency=streams.append)
+                except Exception as e:
+                    errors += 1
+                    print(f"  {name} {size}: {str(e)}")
+                    continue
+                stream = streams[0]
+                if stream.usage is not None:
+                    samples["input_tokens"].append(stream.usage.prompt_token_count or 0)
+                    samples["output_tokens"].append(stream.usage.candidates_token_count or 0)
+                samples["latency_ms"].append(stream.total_time * 1000)
+                if stream.time_to_first_token is not None:
+                    samples["first_token_ms"].append(stream.time_to_first_token * 1000)
+                outputs[f"{size}/{index}"] = corrected
+        results[size] = {
+            "input_tokens": mean(samples["input_tokens"]),
+            "output_tokens": mean(samples["output_tokens"]),
+            "latency_p50_ms": main.percentile(samples["latency_ms"], 50),
+            "latency_p95_ms": main.percentile(samples["latency_ms"], 95),
+            "first_token_p50_ms": main.percentile(samples["first_token_ms"], 50),
+            "errors": errors,
+        }
+    return results, outputs
+
+
+async def run_formats(client, corpus, args):
+    """run_format for each format in args.formats, on one event loop; return the report entries"""
+    entries = {}
+    baseline = None
+    for name in args.formats:
+        print(f"Running {name}...")
+        results, outputs = await run_format(client, name, corpus, args)
+        if baseline is None:
+            baseline = outputs
+        same = agreement(outputs, baseline) if name != args.formats[0] else None
+        entries[name] = {"results": results, "agreement": same}
+    return entries
+
+
+def agreement(outputs, baseline):
+    """Share of texts corrected exactly like the baseline format did"""
+    shared = [key for key in outputs if key in baseline]
+    if not shared:
+        return None
+    return sum(outputs[key] == baseline[key] for key in shared) / len(shared)
+
+
+def print_report(report):
+    print()
+    print(f"{'format':<14}{'size':<8}{'in tok':>9}{'out tok':>9}{'p50 ms':>9}{'p95 ms':>9}{'TTFT ms':>9}")
+    for name, entry in report["formats"].items():
+        for size, stats in entry["results"].items():
+            cells = [stats["input_tokens"], stats["output_tokens"], stats["latency_p50_ms"],
+                     stats["latency_p95_ms"], stats["first_token_p50_ms"]]
+            print(f"{name:<14}{size:<8}" + "".join(f"{'-':>9}" if c is None else f"{c:>9.0f}" for c in cells))
+        if entry["agreement"] is not None:
+            print(f"{'':<14}same corrections as {report['baseline']}: {entry['agreement']:.0%}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare token counts and latency of the request formats")
+    parser.add_argument("--live", action="store_true", help="Use the real API with SSG_API_KEY instead of the fake server")
+    parser.add_argument("--model", default=main.MODEL)
+    parser.add_argument("--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS))
+    parser.add_argument("--iterations", type=int, default=3, help="Passes over the corpus per format")
+    parser.add_argument("--corpus", help="Directory with short/, medium/ and long/ folders of .txt files")
+    parser.add_argument("--no-streaming", action="store_true", help="Use generate_content instead of streaming")
+    parser.add_argument("--model-latency-ms", type=float, default=300.0, help="Fake server response delay")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Result file (default: benchmark_results/formats_<timestamp>.json)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(rng)
+    report = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "live": args.live,
+            "model": args.model,
+            "streaming": not args.no_streaming,
+            "iterations": args.iterations,
+        },
+        "baseline": args.formats[0],
+        "formats": {},
+    }
+
+    with contextlib.ExitStack() as stack:
+        if args.live:
+            if not main.GEMINI_API_KEY:
+                raise SystemExit("[ERROR] Set SSG_API_KEY to benchmark against the real API")
+            api_key = main.GEMINI_API_KEY
+        else:
+            from fake_gemini_server import FakeGeminiServer, LatencyModel
+            server = stack.enter_context(FakeGeminiServer(
+                latency=LatencyModel("lognormal", args.model_latency_ms, 0.35, rng=rng), rng=rng,
+            ))
+            main.GEMINI_BASE_URL = server.base_url
+            api_key = "benchmark"
+        client = main.make_gemini_client(api_key)
+        report["formats"] = asyncio.run(run_formats(client, corpus, args))
+
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIR, f"formats_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
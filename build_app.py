@@ -40,7 +40,26 @@ a = Analysis(
     hiddenimports=[
         'google.genai',
         'google.genai.types',
+        'tkinter',
+        'tkinter.ttk',
+        'tkinter.messagebox',
+        'tkinter.simpledialog',
+        'keyboard',
+        'pyperclip',
+        'pyautogui',
+        'pystray',
+        'PIL.Image',
+        'PIL.ImageDraw',
+        'keyring',
+        'httpx',
+        'h2',
+        'http.server',
+        'socketserver',
+        'sqlite3',
         'keyring.backends.macOS',
+        'AppKit',
+        'Foundation',
+        'objc',
         'pystray._darwin',
         'PIL._tkinter_finder'
     ],
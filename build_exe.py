@@ -40,6 +40,22 @@ a = Analysis(
     hiddenimports=[
         'google.genai',
         'google.genai.types',
+        'tkinter',
+        'tkinter.ttk',
+        'tkinter.messagebox',
+        'tkinter.simpledialog',
+        'keyboard',
+        'pyperclip',
+        'pyautogui',
+        'pystray',
+        'PIL.Image',
+        'PIL.ImageDraw',
+        'keyring',
+        'httpx',
+        'h2',
+        'http.server',
+        'socketserver',
+        'sqlite3',
         'keyring.backends.Windows',
         'keyring.backends._Windows_cffi',
         'pystray._win32',
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini API used by Simple Stupid Grammar
+Implements the generateContent, streamGenerateContent, countTokens and model
+lookup endpoints well enough for the app, benchmarks and tests to run offline.
+
+Usage:
+    python fake_gemini_server.py --port 8765 --latency-ms 300 --error-rate 0.01
+
+Then start the app against it:
+    SSG_GEMINI_BASE_URL=http://127.0.0.1:8765 SSG_API_KEY=fake python main.py
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+MODEL_PATH = re.compile(r"^/v1(?:beta|alpha)?/(models/[^:/]+)(?::(\w+))?$")
+SENTENCE_SEPARATOR = re.compile(r"\n\s*###\s*\n")  # Plain-text sentence batches (main.SENTENCE_DELIMITER)
+
+
+def identity_correction(text):
+    """Fallback when the local rule engine from main.py can't be imported"""
+    return text
+
+
+def load_corrector():
+    """Use the app's offline rule engine so responses look like real corrections"""
+    try:
+        from main import LocalRuleBackend
+        return LocalRuleBackend().correct
+    except Exception as e:
+        print(f"[WARNING] Local rule engine unavailable, echoing text back: {e}")
+        return identity_correction
+
+
+class LatencyModel:
+    """Draws response delays from a configurable distribution"""
+
+    def __init__(self, distribution="lognormal", mean_ms=300.0, spread=0.5, rng=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean_ms = mean_ms
+        self.spread = spread
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        """Return a delay in seconds"""
+        mean = self.mean_ms / 1000.0
+        if mean <= 0:
+            return 0.0
+        if self.distribution == "fixed":
+            return mean
+        if self.distribution == "uniform":
+            return self.rng.uniform(mean * (1 - self.spread), mean * (1 + self.spread))
+        if self.distribution == "exponential":
+            return self.rng.expovariate(1.0 / mean)
+        # Lognormal with the requested mean; spread is sigma of the underlying normal
+        mu = math.log(mean) - self.spread ** 2 / 2
+        return self.rng.lognormvariate(mu, self.spread)
+
+
+class FakeGeminiServer:
+    """Threaded HTTP server answering like the Gemini API; usable as a context manager"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, error_rate=0.0, rate_limit_rate=0.0,
+                 stream_chunk_chars=40, stream_chunk_delay_ms=20.0, rng=None, corrector=None):
+        self.rng = rng or random.Random()
+        self.latency = latency or LatencyModel(rng=self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_delay = stream_chunk_delay_ms / 1000.0
+        self.corrector = corrector or load_corrector()
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="FakeGeminiServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the port"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def roll_failure(self):
+        """Return (status, reason) for an injected failure, or None"""
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return 429, "RESOURCE_EXHAUSTED"
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, "INTERNAL"
+        return None
+
+    def answer(self, body):
+        """Build the JSON text the model would return for a request body"""
+        text = request_text(body)
+        schema = (body.get("generationConfig") or {}).get("responseSchema") or {}
+        properties = schema.get("properties") or {}
+        if "corrected_sentences" in properties:
+            try:
+                sentences = json.loads(text)
+            except ValueError:
+                sentences = [text]
+            return json.dumps({"corrected_sentences": [self.corrector(s) for s in sentences]}, ensure_ascii=False)
+        if SENTENCE_SEPARATOR.search(text):
+            return "\n###\n".join(self.corrector(s.strip()) for s in SENTENCE_SEPARATOR.split(text))
+        corrected = self.corrector(text)
+        if (body.get("generationConfig") or {}).get("responseMimeType") == "application/json":
+            return json.dumps({"corrected_text": corrected}, ensure_ascii=False)
+        return corrected
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output clean
+
+            def do_GET(self):
+                match = MODEL_PATH.match(urlparse(self.path).path)
+                if not match or match.group(2):
+                    return self.send_error_json(404, "NOT_FOUND", "Unknown endpoint")
+                server.count("requests")
+                self.send_json(200, {"name": match.group(1), "displayName": "Fake Gemini",
+                                     "inputTokenLimit": 1048576, "outputTokenLimit": 8192})
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                match = MODEL_PATH.match(parsed.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self.send_error_json(400, "INVALID_ARGUMENT", "Body is not JSON")
+                if not match:
+                    return self.send_error_json(404, "NOT_FOUND", "Unknown endpoint")
+                server.count("requests")
+                model, method = match.group(1), match.group(2)
+
+                if method == "countTokens":
+                    tokens = max(1, len(request_text(body, strip_prompt=False)) // 4)
+                    return self.send_json(200, {"totalTokens": tokens})
+                if method not in ("generateContent", "streamGenerateContent"):
+                    return self.send_error_json(404, "NOT_FOUND", f"Unknown method {method}")
+
+                time.sleep(server.latency.sample())
+                failure = server.roll_failure()
+                if failure:
+                    status, reason = failure
+                    server.count("rate_limited" if status == 429 else "errors")
+                    return self.send_error_json(status, reason, "Injected failure from fake server")
+
+                answer = server.answer(body)
+                usage = usage_metadata(body, answer)
+                if method == "generateContent":
+                    return self.send_json(200, response_json(model, answer, usage, final=True))
+
+                sse = parse_qs(parsed.query).get("alt") == ["sse"]
+                try:
+                    self.stream(model, answer, usage, sse)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # Client cancelled the stream, e.g. a hedged request that lost
+
+            def stream(self, model, answer, usage, sse):
+                size = max(1, server.stream_chunk_chars)
+                chunks = [answer[i:i + size] for i in range(0, len(answer), size)] or [""]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                if not sse:
+                    self.write_chunk("[")
+                for index, chunk in enumerate(chunks):
+                    final = index == len(chunks) - 1
+                    payload = json.dumps(response_json(model, chunk, usage, final=final), ensure_ascii=False)
+                    if sse:
+                        self.write_chunk(f"data: {payload}\r\n\r\n")
+                    else:
+                        self.write_chunk(payload + ("]" if final else ","))
+                    if not final:
+                        time.sleep(server.stream_chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_error_json(self, status, reason, message):
+                self.send_json(status, {"error": {"code": status, "message": message, "status": reason}})
+
+        return Handler
+
+
+def request_text(body, strip_prompt=True):
+    """Extract the text to correct from a generateContent body"""
+    parts = []
+    for content in body.get("contents") or []:
+        for part in content.get("parts") or []:
+            parts.append(part.get("text") or "")
+    text = "".join(parts)
+    if strip_prompt and not body.get("systemInstruction") and ": " in text:
+        # The instruction is prepended to the text, ending with ": "
+        text = text.split(": ", 1)[1]
+    return text
+
+
+def usage_metadata(body, answer):
+    prompt_tokens = max(1, len(request_text(body, strip_prompt=False)) // 4)
+    system = body.get("systemInstruction") or {}
+    prompt_tokens += sum(len(part.get("text") or "") for part in system.get("parts") or []) // 4
+    output_tokens = max(1, len(answer) // 4)
+    return {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens,
+    }
+
+
+def response_json(model, text, usage, final):
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if final:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": model.split("/", 1)[-1]}
+
+
+def main():
+    """Run the fake server until interrupted"""
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Mean response delay")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="Relative spread (uniform) or sigma (lognormal)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--stream-chunk-chars", type=int, default=40)
+    parser.add_argument("--stream-chunk-delay-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = FakeGeminiServer(
+        host=args.host,
+        port=args.port,
+        latency=LatencyModel(args.latency_dist, args.latency_ms, args.latency_spread, rng=rng),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        stream_chunk_chars=args.stream_chunk_chars,
+        stream_chunk_delay_ms=args.stream_chunk_delay_ms,
+        rng=rng,
+    )
+    print(f"Fake Gemini server listening on {server.base_url}")
+    print(f"Run the app with: SSG_GEMINI_BASE_URL={server.base_url} SSG_API_KEY=fake python main.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping fake server")
+    finally:
+        server.httpd.server_close()
+        print(f"Served {server.stats['requests']} requests "
+              f"({server.stats['errors']} errors, {server.stats['rate_limited']} rate limited)")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
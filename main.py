@@ -4,93 +4,3403 @@ Simple Stupid Grammar - Windows Background App
 A system-wide grammar correction tool that runs in the system tray.
 """
 
-import threading
 import time
+import threading
 import json
 import sys
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import keyboard
-import pyperclip
-import pyautogui
-from google import genai
-from google.genai import types
-import pystray
-from PIL import Image, ImageDraw
+import os
+import random
+import re
+import hashlib
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import importlib
+from collections import Counter, OrderedDict, deque
 import io
-import keyring
+import pathlib
+import select
+import zlib
+
+STARTED_AT = time.perf_counter()  # For the time-to-hotkey-ready measurement
+
+
+class LazyModule:
+    """Stand-in for a module that is imported the first time one of its attributes is used"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes not set in __init__, i.e. the module's own
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+# GUI, input and API libraries take from tens of milliseconds (tkinter, keyboard)
+# to over a second (google.genai, pyautogui) to import, so they are loaded on first
+# use instead of before the window and hotkey can come up.
+# build_exe.py and build_app.py list them as hidden imports for PyInstaller.
+tk = LazyModule("tkinter")
+ttk = LazyModule("tkinter.ttk")
+messagebox = LazyModule("tkinter.messagebox")
+simpledialog = LazyModule("tkinter.simpledialog")
+keyboard = LazyModule("keyboard")
+pyperclip = LazyModule("pyperclip")
+pyautogui = LazyModule("pyautogui")
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+pystray = LazyModule("pystray")
+Image = LazyModule("PIL.Image")
+ImageDraw = LazyModule("PIL.ImageDraw")
+keyring = LazyModule("keyring")
+httpx = LazyModule("httpx")
+xdisplay = LazyModule("Xlib.display")  # python-xlib, Linux only
+X = LazyModule("Xlib.X")
+XK = LazyModule("Xlib.XK")
+Xatom = LazyModule("Xlib.Xatom")
+xevent = LazyModule("Xlib.protocol.event")
+xerror = LazyModule("Xlib.error")
+http_server = LazyModule("http.server")
+socketserver = LazyModule("socketserver")
+sqlite3 = LazyModule("sqlite3")
+
+
+# Application constants
+SERVICE_NAME = "SimpleStupidGrammar"
+CREDENTIAL_NAME = "GoogleAPIKey"
+
+# Try different hotkey combinations if ctrl+alt+0 doesn't work:
+# KEYBOARD_HOTKEY = "ctrl+shift+g"  # Alternative 1
+# KEYBOARD_HOTKEY = "ctrl+alt+g"    # Alternative 2
+KEYBOARD_HOTKEY = "f9"  # Alternative 3
+# KEYBOARD_HOTKEY = "ctrl+alt+0"
+
+MODEL = "models/gemini-2.0-flash-lite"
+PROMPT = "Make the following text grammatically correct: "
+SENTENCE_PROMPT = (
+    "Make each of the following sentences grammatically correct. "
+    "Return exactly one corrected sentence for each input sentence, in the same order: "
+)
+# Plain-text answers have no response schema, so the format is spelled out instead
+SENTENCE_DELIMITER = "###"
+TEXT_PROMPT = "Make the following text grammatically correct and reply with the corrected text only: "
+TEXT_SENTENCE_PROMPT = (
+    "Make each of the following sentences grammatically correct. The sentences are separated by lines "
+    f"containing only {SENTENCE_DELIMITER}. Reply with exactly one corrected sentence for each, in the same "
+    "order and separated the same way, and nothing else: "
+)
+
+# Request format (python benchmark_formats.py compares the token counts and latency of each)
+SYSTEM_INSTRUCTIONS = True  # Send the instructions as a system instruction rather than in front of every text
+OUTPUT_MODE = "json"  # "json": a {"corrected_text": ...} object; "text": the corrected text itself, no JSON framing
+
+# Correction cache settings
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".simple_stupid_grammar")
+CACHE_DIR = os.path.join(APP_DATA_DIR, "cache")
+CACHE_MEMORY_ENTRIES = 1024  # Corrections (whole texts and single sentences) kept in the in-memory LRU
+CACHE_DISK_MAX_BYTES = 20 * 1024 * 1024  # On-disk store is trimmed to this size
+
+# Clipboard timing settings (seconds). These are hard deadlines, not fixed waits:
+# every phase finishes as soon as the clipboard or keyboard shows it is done.
+HOTKEY_RELEASE_TIMEOUT = 1.0  # Wait for the user to let go of the hotkey before sending Ctrl+C
+COPY_TIMEOUT = 1.0  # Wait for the target app to put the selection on the clipboard
+PASTE_READY_TIMEOUT = 0.3  # Wait for our corrected text to be readable from the clipboard
+# Linux/X11: read the highlighted text from the PRIMARY selection and type shortcuts with XTest (needs
+# python-xlib). Without it, or on Wayland, Ctrl+C and the clipboard are used like on Windows and macOS.
+X11_INPUT = True
+X11_SELECTION_TIMEOUT = 0.2  # Wait for the selection owner to answer before falling back to Ctrl+C
+X11_SELECTION_MAX_AGE = 5.0  # Older highlights are copied with Ctrl+C, in case they are no longer highlighted
+POLL_INITIAL_INTERVAL = 0.002
+POLL_MAX_INTERVAL = 0.05
+NATIVE_CLIPBOARD = True  # Talk to the clipboard in-process (AppKit on macOS, Xlib on Linux) instead of via pyperclip
+INPUT_PROBE = True  # On first start in a session, find the injection method whose Ctrl+C reaches a field of our own
+INPUT_REPROBE_AFTER = 2  # Copies in a row that change nothing before the other injection methods are tried again
+INPUT_REPROBE_TIMEOUT = 1.0  # Seconds one copy may spend waiting on all the injection methods it tries
+INPUT_METHOD_PATH = os.path.join(APP_DATA_DIR, "input_method.json")  # Injection method that worked, per session
+
+# Correction engine settings
+MAX_CONCURRENT_CORRECTIONS = 4  # Outstanding API requests at once
+
+# Streaming settings
+STREAMING = True  # Use generate_content_stream and decode the answer as it arrives
+STREAM_PREVIEW = True  # Show the partially corrected text in a small overlay while streaming
+PREVIEW_MAX_CHARS = 600  # Only the tail of long corrections is shown in the overlay
+
+# Large selection settings
+CHUNK_THRESHOLD_TOKENS = 1000  # Selections estimated above this are corrected in parallel chunks
+CHUNK_MAX_TOKENS = 500  # Target size of each chunk
+CHUNK_WORKERS = 4  # Chunks corrected concurrently
+CLIPBOARD_RESTORE_DELAY = 2.0  # Seconds before the original clipboard is put back after pasting
+CLIPBOARD_RESTORE_AFTER_READ = 0.2  # X11: restore this soon after an application read the pasted text
+
+# Instrumentation settings
+TRACE_BUFFER_SIZE = 1000  # Recent corrections kept in memory for the stats panel
+TRACE_LOG_PATH = os.environ.get("SSG_TRACE_LOG")  # Optional JSONL file receiving every correction's timings
+STATS_REFRESH_MS = 2000  # How often the stats panel and tray menu are refreshed (and dead threads restarted)
+THREAD_MAX_RESTARTS = 3  # Give up on a thread that keeps dying instead of restarting it forever
+CHARS_PER_TOKEN = 4  # Rough token estimate for English prose
+PARAGRAPH_BREAK = re.compile(r"(\r?\n[ \t]*\r?\n\s*)")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])(\s+)")
+
+# Re-use corrections of unchanged sentences and only send new or edited ones
+SENTENCE_CACHE = True
+
+# Correction backend: "gemini", "local" (offline rules only) or "auto"
+# In "auto" mode short selections are fixed locally and Gemini failures fall back to local rules
+BACKEND = "gemini"
+LOCAL_BACKEND_MAX_CHARS = 40  # "auto": selections up to this length never leave the machine
+LOCAL_FALLBACK = True  # "auto": use local rules when Gemini errors out or times out
+GEMINI_TIMEOUT = 15.0  # Seconds before a Gemini request counts as failed
+
+# Speculative correction: start correcting text as soon as it is copied, so F9 on the same text is instant
+SPECULATIVE = False  # Opt in: copied text is sent to Gemini even when F9 is never pressed
+SPECULATIVE_POLL = 0.3  # Seconds between clipboard checks
+SPECULATIVE_MIN_CHARS = LOCAL_BACKEND_MAX_CHARS + 1  # Shorter text is quick to correct (or local in "auto")
+SPECULATIVE_MAX_CHARS = 4000  # Long copies are rarely corrected and cost the most quota
+SPECULATIVE_MIN_AVAILABLE = 2  # Only while the rate limiter has this many requests to spare, so F9 never waits
+# Copies made in these apps are never sent (case-insensitive part of the app name)
+SPECULATIVE_DENYLIST = (
+    "1password", "bitwarden", "keepass", "lastpass", "dashlane", "keychain",
+    "terminal", "iterm", "cmd.exe", "powershell",
+)
+
+# Quota protection: client-side rate limit, retries and a circuit breaker around every Gemini correction
+RATE_LIMIT_RPM = 30  # Requests per minute allowed by the API quota (hedges and retries included)
+RATE_LIMIT_BURST = 5  # Requests that may be sent back to back
+REQUEST_DEADLINE = GEMINI_TIMEOUT  # Seconds one correction may spend on rate limiting, retries and requests
+RETRY_ATTEMPTS = 3
+RETRY_INITIAL_DELAY = 0.25  # Backoff doubles with each retry up to RETRY_MAX_DELAY, with full jitter
+RETRY_MAX_DELAY = 4.0
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+BREAKER_FAILURES = 5  # Consecutive network, timeout or 5xx failures before failing fast
+BREAKER_COOLDOWN = 30.0  # Seconds of failing fast before a trial request is let through
+
+# Model routing: a request goes to the first model in MODELS that takes its size and keeps within the latency budget
+MODELS = [  # (model, largest estimated token count it gets or None), fastest first
+    (MODEL, None),
+    ("models/gemini-2.0-flash", None),
+]
+ROUTING_P95_BUDGETS = (1.5, 2.5, 5.0, 15.0)  # Seconds, per LATENCY_SIZE_CLASSES class (up to 64, 256, 1024 tokens, more)
+ROUTING_MIN_SAMPLES = 10  # Latencies needed before a model's p95 is trusted
+ROUTING_RETRY_AFTER = 300.0  # Seconds before a model skipped for being too slow is given another chance
+
+# Tail latency: timeouts and hedged requests follow live per-model latency histograms
+HEDGING = True  # Send a duplicate request when the first one is slower than usual and take the first answer
+HEDGE_MODEL = None  # Model for the duplicate request; None uses the model the request was routed to
+HEDGE_BUDGET = 0.1  # At most this share of requests is hedged; hedging starts at the matching percentile (p90)
+HEDGE_BURST = 3  # Hedges that may happen back to back before the budget has to refill
+HEDGE_MIN_SAMPLES = 20  # Latencies needed for a model and size class before hedging and adaptive timeouts start
+TIMEOUT_PERCENTILE = 0.99
+TIMEOUT_MULTIPLIER = 3.0  # Adaptive timeout: this many times the p99 latency, between MIN_TIMEOUT and GEMINI_TIMEOUT
+MIN_TIMEOUT = 2.0
+LATENCY_SIZE_CLASSES = (64, 256, 1024)  # Estimated-token boundaries; requests are compared with similar sizes
+HISTOGRAM_HALF_LIFE = 200  # Samples after which older latencies count half, so the histogram follows current conditions
+
+# Connection pool: keep the connection to Gemini open so F9 doesn't pay for DNS, TCP and TLS setup
+HTTP2 = True  # Used when the h2 package is installed, HTTP/1.1 otherwise
+KEEPALIVE_CONNECTIONS = MAX_CONCURRENT_CORRECTIONS + CHUNK_WORKERS
+KEEPALIVE_EXPIRY = 300.0  # Seconds an idle pooled connection is kept open (httpx default is 5)
+WARMUP = True  # Open the connections with a cheap model lookup once the client exists
+WARMUP_IDLE_SECONDS = 120.0  # Re-warm after this long without any request (0 disables)
+WARMUP_MAX_IDLE = 3600.0  # Stop re-warming after this long without a correction
+
+# Batch mode: python main.py FILE... (or simple-stupid-grammar FILE...) corrects files without the GUI
+BATCH_CONCURRENCY = MAX_CONCURRENT_CORRECTIONS  # Paragraphs corrected at once
+BATCH_EXTENSIONS = (".txt", ".md", ".rst")  # File types picked up from directories
+BATCH_MANIFEST = ".ssg_manifest.json"  # Records finished files so an interrupted run can resume
+
+# Local API: editors and scripts send text to the running app (or python main.py --serve) instead of
+# using their own client, so they share its warm connections, cache and rate limit
+SERVER_ENABLED = False  # Serve the API while the tray app runs
+SERVER_HOST = "127.0.0.1"  # Keep it on localhost; anyone who can connect can spend your quota
+SERVER_PORT = 8766
+SERVER_SOCKET = None  # Path of a Unix socket to listen on instead of SERVER_HOST:SERVER_PORT
+SERVER_TOKEN = os.environ.get("SSG_SERVER_TOKEN")  # When set, requests need "Authorization: Bearer <token>"
+SERVER_MAX_BODY = 1024 * 1024  # Bytes
+SERVER_MAX_BATCH = 256  # Texts per correct-batch request
+SERVER_TIMEOUT = 120.0  # Seconds a request may take, including waiting for the rate limiter
+
+# Correction history: every hotkey correction is kept so it can be looked up and pasted again
+HISTORY = True
+HISTORY_PATH = os.path.join(APP_DATA_DIR, "history.sqlite3")
+HISTORY_MAX_AGE_DAYS = 90  # Older corrections are deleted
+HISTORY_MAX_BYTES = 50 * 1024 * 1024  # Compressed texts kept before the oldest corrections are deleted
+HISTORY_PAGE_SIZE = 200  # Rows the history window loads at a time
+HISTORY_REPASTE_DELAY = 0.3  # Seconds for the previous window to get the focus back before a re-paste
+
+# Point the Gemini client at another server, e.g. fake_gemini_server.py for offline testing
+GEMINI_BASE_URL = os.environ.get("SSG_GEMINI_BASE_URL")
+GEMINI_API_KEY = os.environ.get("SSG_API_KEY")  # Used instead of the stored key when set
+
+# Local rule engine data
+COMMON_TYPOS = {
+    "teh": "the", "adn": "and", "thier": "their", "recieve": "receive", "recieved": "received",
+    "beleive": "believe", "wich": "which", "untill": "until", "occured": "occurred",
+    "seperate": "separate", "definately": "definitely", "alot": "a lot", "becuase": "because",
+    "acheive": "achieve", "adress": "address", "begining": "beginning", "calender": "calendar",
+    "enviroment": "environment", "goverment": "government", "freind": "friend",
+    "neccessary": "necessary", "occassion": "occasion", "publically": "publicly",
+    "tommorow": "tomorrow", "truely": "truly", "wierd": "weird", "writting": "writing",
+    "dont": "don't", "doesnt": "doesn't", "didnt": "didn't",
+    "isnt": "isn't", "wasnt": "wasn't", "couldnt": "couldn't", "shouldnt": "shouldn't",
+    "wouldnt": "wouldn't", "im": "I'm", "ive": "I've", "youre": "you're", "theyre": "they're",
+}
+ALLOWED_DOUBLED_WORDS = {"had", "that", "is", "do"}  # "had had", "that that" can be correct
+# Abbreviations whose period doesn't end the sentence ("etc. and", "vs. them", "Dr. smith")
+ABBREVIATIONS = {
+    "etc", "vs", "fig", "figs", "approx", "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "cf", "al",
+    "inc", "ltd", "co", "corp", "dept", "vol", "eq", "ch", "sec", "ca",
+}
+
+
+class CorrectionCache:
+    """Two-tier cache of corrections: a bounded in-memory LRU in front of a persistent on-disk store"""
+
+    def __init__(self, directory=CACHE_DIR, max_entries=CACHE_MEMORY_ENTRIES, max_disk_bytes=CACHE_DISK_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # Computed lazily on first write
+
+        if self.directory:  # None keeps the cache in memory only
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Correction cache directory unavailable, using memory only: {str(e)}")
+                self.directory = None
+
+    @staticmethod
+    def make_key(text, model=MODEL, prompt=PROMPT):
+        """Build a cache key covering the text, the model and the prompt"""
+        payload = json.dumps([model, prompt, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached correction for key, or None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        value = self._read_disk(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store a correction in both tiers"""
+        self._remember(key, value)
+        self._write_disk(key, value)
+
+    async def get_or_compute_async(self, key, compute, keep=None):
+        """Return the cached value for key, awaiting compute() at most once for concurrent identical requests.
+
+        keep(), when given, decides whether the computed value is stored;
+        concurrent identical requests get it either way.
+        """
+        while True:
+            value, future, owner = self._claim(key)
+            if value is not None:
+                return value
+            if owner:
+                break
+            # Shielded: a waiter that is cancelled must not cancel the request for everyone else
+            value = await asyncio.shield(asyncio.wrap_future(future))
+            if value is not None:
+                return value
+
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._release(key, future, error=e)
+            raise
+        self._release(key, future, value=value, store=keep is None or keep())
+        return value
+
+    def _claim(self, key):
+        # Returns (cached value, in-flight future, whether the caller must compute it)
+        value = self.get(key)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+                return value, None, False
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.hits += 1
+                return None, future, False
+            self.misses += 1
+            future = concurrent.futures.Future()
+            self._in_flight[key] = future
+            return None, future, True
+
+    def _release(self, key, future, value=None, error=None, store=True):
+        if error is None and store:
+            self.put(key, value)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is None:
+            future.set_result(value)
+        elif isinstance(error, (asyncio.CancelledError, concurrent.futures.CancelledError)):
+            future.set_result(None)  # Abandoned, not failed: waiters compute it themselves
+        else:
+            future.set_exception(error)
+            # Mark the exception as retrieved so lone owners don't log "never retrieved" warnings
+            future.exception()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["corrected_text"]
+            os.utime(path)  # Mark as recently used for eviction
+            return value
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.directory:
+            return
+        path = self._path(key)
+        data = json.dumps({"corrected_text": value}, ensure_ascii=False).encode("utf-8")
+        with self._disk_lock:
+            try:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+                if os.path.exists(path):
+                    self._disk_bytes -= os.path.getsize(path)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._disk_bytes += len(data)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+            except OSError as e:
+                print(f"Failed to write correction cache: {str(e)}")
+
+    def _disk_entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict_disk(self):
+        # Drop least recently used entries until we are back under 90% of the budget
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in sorted(self._disk_entries()):
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+
+def wait_until(condition, timeout, initial_delay=0.0):
+    """Poll condition with exponential backoff until it is true or timeout expires; return whether it became true"""
+    deadline = time.perf_counter() + timeout
+    if initial_delay > 0:
+        time.sleep(min(initial_delay, timeout))
+    interval = POLL_INITIAL_INTERVAL
+    while True:
+        try:
+            if condition():
+                return True
+        except Exception:
+            pass
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+
+def clipboard_sequence_number():
+    """Return the OS clipboard change counter, or None where the platform has no cheap one"""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            return ctypes.windll.user32.GetClipboardSequenceNumber()
+        if sys.platform == "darwin":
+            from AppKit import NSPasteboard
+            return NSPasteboard.generalPasteboard().changeCount()
+    except Exception:
+        pass
+    return None
+
+
+def foreground_app_name():
+    """Return a short name for the application that currently has focus"""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+            user32 = ctypes.windll.user32
+            kernel32 = ctypes.windll.kernel32
+            pid = wintypes.DWORD()
+            user32.GetWindowThreadProcessId(user32.GetForegroundWindow(), ctypes.byref(pid))
+            handle = kernel32.OpenProcess(0x1000, False, pid.value)  # PROCESS_QUERY_LIMITED_INFORMATION
+            if handle:
+                try:
+                    buffer = ctypes.create_unicode_buffer(260)
+                    size = wintypes.DWORD(260)
+                    if kernel32.QueryFullProcessImageNameW(handle, 0, buffer, ctypes.byref(size)):
+                        return os.path.basename(buffer.value).lower()
+                finally:
+                    kernel32.CloseHandle(handle)
+        elif sys.platform == "darwin":
+            from AppKit import NSWorkspace
+            return str(NSWorkspace.sharedWorkspace().frontmostApplication().localizedName())
+    except Exception:
+        pass
+    return "unknown"
+
+
+def looks_like_prose(text):
+    """Rough check that copied text is sentences rather than code, a URL, numbers or a password"""
+    if len(text.split()) < 3 or "://" in text:
+        return False
+    visible = sum(not c.isspace() for c in text)
+    letters = sum(c.isalpha() for c in text)
+    code_lines = len(re.findall(r"[{};]\s*$", text, re.MULTILINE))
+    return letters >= 0.7 * visible and code_lines <= text.count("\n") // 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used to size requests"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_into_chunks(text, max_tokens=CHUNK_MAX_TOKENS):
+    """Split text on paragraph, then sentence, boundaries into chunks of about max_tokens.
+
+    Returns a list alternating chunk, separator, chunk, ... so that
+    "".join(result) == text and separators can be put back verbatim.
+    """
+    units = []
+    for index, part in enumerate(PARAGRAPH_BREAK.split(text)):
+        if index % 2 == 0 and estimate_tokens(part) > max_tokens:
+            units.extend(SENTENCE_BREAK.split(part))
+        else:
+            units.append(part)
+
+    pieces = []
+    current = units[0]
+    for index in range(1, len(units), 2):
+        separator, following = units[index], units[index + 1]
+        if estimate_tokens(current + separator + following) <= max_tokens:
+            current += separator + following
+        else:
+            pieces.extend([current, separator])
+            current = following
+    pieces.append(current)
+    return pieces
+
+
+def preserve_layout(original, corrected):
+    """Give corrected the leading/trailing whitespace and line endings of original"""
+    leading = original[:len(original) - len(original.lstrip())]
+    trailing = original[len(original.rstrip()):]
+    corrected = corrected.strip().replace("\r\n", "\n")
+    if "\r\n" in original:
+        corrected = corrected.replace("\n", "\r\n")
+    return leading + corrected + trailing
+
+
+class CopyLatencyTracker:
+    """Learns how long each foreground application takes to put a copied selection on the clipboard"""
+
+    SMOOTHING = 0.3  # Weight of the newest sample in the moving average
+
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def typical(self, app):
+        """Return the learned copy latency for app, or None if we have not seen it yet"""
+        with self._lock:
+            return self._latencies.get(app)
+
+    def record(self, app, latency):
+        """Fold a measured copy latency into the moving average for app"""
+        with self._lock:
+            previous = self._latencies.get(app)
+            if previous is None:
+                self._latencies[app] = latency
+            else:
+                self._latencies[app] = previous + self.SMOOTHING * (latency - previous)
+
+    def initial_delay(self, app):
+        """How long to sleep before the first clipboard poll for app"""
+        typical = self.typical(app)
+        # Sleep through most of the expected latency, then poll quickly for the rest
+        return typical * 0.5 if typical else 0.0
+
+    def timeout(self, app):
+        """Deadline for the copy phase in app"""
+        typical = self.typical(app)
+        if typical is None:
+            return COPY_TIMEOUT
+        return min(COPY_TIMEOUT, max(0.2, typical * 4))
+
+
+class CorrectionEngine:
+    """Runs the copy -> correct -> paste pipeline on a dedicated asyncio event loop.
+
+    The keyboard hook only calls submit(), which hands the press to the loop and
+    returns immediately. Presses that arrive while a selection is being captured
+    are coalesced, and a selection that is already being corrected is not sent
+    again. Clipboard work is serialized; model requests run concurrently.
+    A correction is only pasted while its selection is still the latest one
+    and its application still has the focus; one that finishes after a newer
+    capture would land in the newer selection, so it is dropped instead.
+    """
+
+    def __init__(self, app, max_concurrent=MAX_CONCURRENT_CORRECTIONS):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.loop = None
+        self.thread = None
+        self._presses = None
+        self._active = {}  # highlighted text -> task correcting it
+        self._captures = 0  # Selections captured so far; a correction may only paste over the latest
+        self._started = threading.Event()
+
+    def start(self):
+        """Start the event loop thread (idempotent)"""
+        if self.thread and self.thread.is_alive():
+            return
+        self._started.clear()
+        self.thread = threading.Thread(target=self._run, name="CorrectionEngine", daemon=True)
+        self.thread.start()
+        self._started.wait()
+
+    def stop(self):
+        """Cancel outstanding work and stop the event loop"""
+        if not self.loop or not self.thread:
+            return
+        if self.thread.is_alive():  # Its loop is already closed if it died
+            self.loop.call_soon_threadsafe(self._shutdown)
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    def paste(self, text, delay=0.0):
+        """Paste text outside a correction (e.g. from the history), in turn with corrections; safe to call from any thread"""
+        self.start()
+        asyncio.run_coroutine_threadsafe(self._paste(text, delay), self.loop)
+
+    def submit(self):
+        """Queue a hotkey press; safe to call from any thread"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._presses.put_nowait, time.perf_counter())
+
+    def busy(self):
+        """Whether a hotkey correction is in progress"""
+        return bool(self._active)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._presses = asyncio.Queue()
+        self._clipboard_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        dispatcher = self.loop.create_task(self._dispatch())
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            dispatcher.cancel()
+            pending = [task for task in asyncio.all_tasks(self.loop) if not task.done()]
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    def _shutdown(self):
+        self.loop.stop()
+
+    async def _dispatch(self):
+        while True:
+            pressed_at = await self._presses.get()
+            # Several presses while we were busy mean "correct this selection", once
+            while not self._presses.empty():
+                self._presses.get_nowait()
+            trace = CorrectionTrace(pressed_at, recorder=self.app.latency)
+            CURRENT_TRACE.set(trace)
+
+            async with self._clipboard_lock:
+                try:
+                    selection, app = await self.loop.run_in_executor(None, run_in_context(self._capture))
+                except Exception as e:
+                    trace.fail(e)  # Also lets a held clipboard restore go ahead
+                    self.app.notify_error(e)
+                    continue
+            if selection is None:
+                trace.fail("no selection")
+                continue
+
+            highlighted_text = selection[0]
+            if highlighted_text in self._active:
+                print("Selection is already being corrected, ignoring repeated hotkey")
+                trace.fail("coalesced")
+                continue
+            self.app.last_trace = trace
+            self._captures += 1
+            task = self.loop.create_task(self._correct(*selection, trace, self._captures, app))
+            self._active[highlighted_text] = task
+            task.add_done_callback(lambda _, text=highlighted_text: self._active.pop(text, None))
+
+    def _capture(self):
+        """The selection and the application it is in"""
+        selection = self.app.capture_selection()
+        return selection, self.app.keys.foreground_app() if selection is not None else None
+
+    async def _paste(self, text, delay):
+        await asyncio.sleep(delay)
+        try:
+            async with self._clipboard_lock:
+                await self.loop.run_in_executor(None, self.app.paste_text, text)
+        except Exception as e:
+            self.app.notify_error(e)
+
+    async def _correct(self, highlighted_text, original_clipboard, trace, capture, app):
+        if self.app.speculator:
+            self.app.speculator.claim(highlighted_text)
+        try:
+            async with self._slots:
+                corrected_text = await self.app.apply_corrections_async(highlighted_text)
+            trace.mark("corrected")
+            async with self._clipboard_lock:
+                focused = await self.loop.run_in_executor(None, self.app.keys.foreground_app)
+                if capture != self._captures or focused != app:
+                    # The selection this was captured from may be gone; pasting would overwrite other text
+                    print("Selection changed while it was being corrected, not pasting")
+                    trace.fail("superseded")
+                    self.app.notify_error("the selection changed before the correction arrived; press "
+                                          f"{KEYBOARD_HOTKEY} on it again")
+                    return
+                await self.loop.run_in_executor(None, run_in_context(
+                    self.app.replace_selection, highlighted_text, corrected_text, original_clipboard, trace
+                ))
+        except asyncio.CancelledError:
+            trace.fail("cancelled")
+            raise
+        except Exception as e:
+            trace.fail(e)
+            self.app.notify_error(e)
+
+
+class StreamingCorrection:
+    """Accumulates a streamed response and decodes the corrected text seen so far.
+
+    In "json" output mode the response is a {"corrected_text": ...} object; in
+    "text" mode it is the corrected text itself.
+    """
+
+    FIELD = '"corrected_text"'
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, output_mode="json"):
+        self.output_mode = output_mode
+        self.buffer = ""
+        self.usage = None  # Token counts reported with the response, when the API sends them
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+
+    def feed(self, chunk, usage=None):
+        """Add a chunk of raw response text; return the corrected text decoded so far"""
+        if chunk:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.buffer += chunk
+        if usage is not None:
+            self.usage = usage
+        return self.partial_text()
+
+    def partial_text(self):
+        """Decode as much of the corrected_text string as has arrived"""
+        buffer = self.buffer
+        if self.output_mode == "text":
+            return buffer.lstrip()
+        field = buffer.find(self.FIELD)
+        if field < 0:
+            return ""
+        colon = buffer.find(":", field + len(self.FIELD))
+        if colon < 0:
+            return ""
+        quote = buffer.find('"', colon + 1)
+        if quote < 0:
+            return ""
+
+        out = []
+        i = quote + 1
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                break
+            if char != "\\":
+                out.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break  # Escape sequence split across chunks
+            escape = buffer[i + 1]
+            if escape != "u":
+                out.append(self.ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate: wait for its partner so we never emit half a character
+                if i + 12 > len(buffer):
+                    break
+                low = int(buffer[i + 8:i + 12], 16)
+                code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                i += 6
+            out.append(chr(code))
+            i += 6
+        return "".join(out)
+
+    def result(self):
+        """Parse the complete response"""
+        self.finished_at = time.perf_counter()
+        if self.output_mode == "text":
+            return self.buffer.strip()
+        return json.loads(self.buffer)["corrected_text"]
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def total_time(self):
+        return (self.finished_at or time.perf_counter()) - self.started
+
+
+class PreviewOverlay:
+    """Small always-on-top window that shows a streamed correction as it arrives"""
+
+    def __init__(self, root):
+        self.root = root
+        self.window = None
+        self.label = None
+
+    def show(self, text):
+        """Show or update the overlay; safe to call from any thread"""
+        try:
+            self.root.after(0, self._show, text)
+        except (tk.TclError, RuntimeError):
+            pass
+
+    def hide(self):
+        """Close the overlay; safe to call from any thread"""
+        try:
+            self.root.after(0, self._hide)
+        except (tk.TclError, RuntimeError):
+            pass
+
+    def _show(self, text):
+        if len(text) > PREVIEW_MAX_CHARS:
+            text = "..." + text[-PREVIEW_MAX_CHARS:]
+        if self.window is None:
+            self.window = tk.Toplevel(self.root)
+            self.window.overrideredirect(True)
+            self.window.attributes('-topmost', True)
+            self.label = tk.Label(
+                self.window, justify=tk.LEFT, wraplength=480,
+                background="#ffffe0", relief="solid", borderwidth=1, padx=8, pady=6
+            )
+            self.label.pack()
+            x, y = self.root.winfo_pointerxy()
+            self.window.geometry(f"+{x + 16}+{y + 16}")
+        self.label.config(text=text)
+
+    def _hide(self):
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+            self.label = None
+
+
+def http2_available():
+    """Whether the pooled connections can speak HTTP/2 (httpx needs the optional h2 package)"""
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ConnectionStats:
+    """Counts model requests that had to open a new connection instead of reusing a pooled one.
+
+    httpcore reports connection setup through the "trace" request extension,
+    which an httpx request hook attaches to every request the genai client sends.
+    Warm-ups are the only GET requests the app makes and are counted separately.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.cold = 0
+        self.warmups = 0
+        self.http2 = False
+        self.last_request = None
+        self.last_correction = None
+        self._lock = threading.Lock()
+
+    def client_args(self):
+        """Keyword arguments for the sync httpx client"""
+        return self._pool_args(self._on_request)
+
+    def async_client_args(self):
+        """Keyword arguments for the async httpx client"""
+        # With aiohttp installed, genai sends async requests through it and ignores these
+        return self._pool_args(self._on_request_async)
+
+    def _pool_args(self, hook):
+        self.http2 = http2_available()
+        limits = httpx.Limits(
+            max_connections=KEEPALIVE_CONNECTIONS,
+            max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        return {"http2": self.http2, "limits": limits, "event_hooks": {"request": [hook]}}
+
+    def _begin(self, request):
+        """Count a request; return whether it is a warm-up"""
+        warmup = request.method == "GET"
+        now = time.perf_counter()
+        with self._lock:
+            self.last_request = now
+            if warmup:
+                self.warmups += 1
+            else:
+                self.requests += 1
+                self.last_correction = now
+        return warmup
+
+    def _connected(self, warmup):
+        if not warmup:
+            with self._lock:
+                self.cold += 1
+
+    def _on_request(self, request):
+        warmup = self._begin(request)
+
+        def trace(event, info):
+            if event == "connection.connect_tcp.started":
+                self._connected(warmup)
+
+        request.extensions["trace"] = trace
+
+    async def _on_request_async(self, request):
+        warmup = self._begin(request)
+
+        async def trace(event, info):
+            if event == "connection.connect_tcp.started":
+                self._connected(warmup)
+
+        request.extensions["trace"] = trace
+
+    def idle_for(self):
+        """Seconds since the last request of any kind, or None before the first one"""
+        with self._lock:
+            return None if self.last_request is None else time.perf_counter() - self.last_request
+
+    def should_rewarm(self):
+        """Whether the pool has been idle long enough to refresh, and corrections are recent enough to bother"""
+        if not WARMUP_IDLE_SECONDS:
+            return False
+        with self._lock:
+            if self.last_request is None:
+                return False
+            now = time.perf_counter()
+            since_correction = now - (self.last_correction or self.last_request)
+            return now - self.last_request >= WARMUP_IDLE_SECONDS and since_correction < WARMUP_MAX_IDLE
+
+    def summary(self):
+        """One line for the stats panel"""
+        with self._lock:
+            return (f"Connections: {self.cold} cold of {self.requests} requests, "
+                    f"{self.warmups} warm-ups ({'HTTP/2' if self.http2 else 'HTTP/1.1'})")
+
+
+def make_gemini_client(api_key, connections=None):
+    """Create the genai client used by GeminiBackend, with long-lived pooled connections"""
+    connections = connections or ConnectionStats()
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            base_url=GEMINI_BASE_URL,
+            timeout=int(GEMINI_TIMEOUT * 1000),
+            client_args=connections.client_args(),
+            async_client_args=connections.async_client_args(),
+            # One attempt per call: ResilientBackend retries, and errors arrive unwrapped
+            retry_options=types.HttpRetryOptions(attempts=1),
+        ),
+    )
+
+
+class CorrectionBackend:
+    """Something that can correct text. Subclasses implement correct_async(); the rest has sensible defaults.
+
+    Backends that correct in-process without waiting on anything may
+    implement the plain function correct() instead.
+    """
+
+    name = "base"
+    model = None
+
+    def correct(self, text, on_partial=None, on_latency=None):
+        """Return the corrected text, for backends that don't wait on I/O"""
+        raise NotImplementedError
+
+    async def correct_async(self, text, on_partial=None, on_latency=None):
+        """Return the corrected text; calls correct() unless overridden"""
+        return self.correct(text, on_partial, on_latency)
+
+    async def correct_sentences_async(self, sentences):
+        """Correct each sentence of a list and return the corrected list"""
+        return [await self.correct_async(sentence) for sentence in sentences]
+
+    def cache_prompt(self, sentences=False):
+        """Everything besides the model and the text that decides the answer, for cache keys"""
+        return self.name
+
+    async def warm_up_async(self):
+        """Open connections ahead of the first request; nothing to do unless overridden"""
+
+    def summary(self):
+        """One line for the stats panel, or None"""
+        return None
+
+
+class GeminiBackend(CorrectionBackend):
+    """Corrections from a Gemini model through google-genai"""
+
+    name = "gemini"
+
+    TEXT_SCHEMA = {
+        "required": [
+            "corrected_text",
+        ],
+        "properties": {
+            "corrected_text": {"type": "STRING"},
+        },
+        "type": "OBJECT",
+    }
+    SENTENCES_SCHEMA = {
+        "required": [
+            "corrected_sentences",
+        ],
+        "properties": {
+            "corrected_sentences": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "type": "OBJECT",
+    }
+
+    def __init__(self, client, model=MODEL, streaming=STREAMING, output_mode=OUTPUT_MODE,
+                 system_instructions=SYSTEM_INSTRUCTIONS):
+        if output_mode not in ("json", "text"):
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        self.client = client
+        self.model = model
+        self.streaming = streaming
+        self.output_mode = output_mode
+        self.system_instructions = system_instructions
+
+    def prompt(self, sentences=False):
+        """The instructions sent with a text, or with a list of sentences, in the configured format"""
+        if self.output_mode == "json":
+            return SENTENCE_PROMPT if sentences else PROMPT
+        return TEXT_SENTENCE_PROMPT if sentences else TEXT_PROMPT
+
+    def cache_prompt(self, sentences=False):
+        return json.dumps([self.prompt(sentences), self.output_mode, self.system_instructions])
+
+    def request(self, text, sentences=False):
+        """Return (contents, config) for correcting text, or a list of sentences, in the configured format"""
+        prompt = self.prompt(sentences)
+        if self.output_mode == "json":
+            config = {
+                "response_mime_type": "application/json",
+                "response_schema": self.SENTENCES_SCHEMA if sentences else self.TEXT_SCHEMA,
+            }
+            if sentences:
+                text = json.dumps(text, ensure_ascii=False)
+        else:
+            config = {"response_mime_type": "text/plain"}
+            if sentences:
+                text = f"\n{SENTENCE_DELIMITER}\n".join(text)
+        if not self.system_instructions:
+            return prompt + text, types.GenerateContentConfig(**config)
+        # The instruction goes out once per request either way; as a system instruction
+        # it is kept apart from the text. Context caching would avoid resending it, but
+        # the API only caches contexts of at least a thousand tokens.
+        return text, types.GenerateContentConfig(system_instruction=prompt.rstrip(": ") + ".", **config)
+
+    def parse_sentences(self, answer):
+        """Turn a sentence-batch answer back into a list"""
+        if self.output_mode == "json":
+            return json.loads(answer)["corrected_sentences"]
+        delimiter = re.compile(rf"^\s*{re.escape(SENTENCE_DELIMITER)}\s*$", re.MULTILINE)
+        return [sentence.strip() for sentence in delimiter.split(answer.strip())]
+
+    async def correct_async(self, text, on_partial=None, on_latency=None):
+        stream = StreamingCorrection(self.output_mode)
+        contents, config = self.request(text)
+        if self.streaming:
+            async for chunk in await self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=contents,
+                config=config,
+            ):
+                partial = stream.feed(chunk.text, chunk.usage_metadata)
+                if on_partial:
+                    on_partial(partial)
+        else:
+            response = await self.client.aio.models.generate_content(
+                model=self.model,
+                contents=contents,
+                config=config,
+            )
+            stream.feed(response.text, response.usage_metadata)
+        corrected = stream.result()
+        if on_latency:
+            on_latency(stream)
+        return corrected
+
+    async def correct_sentences_async(self, sentences):
+        if not sentences:
+            return []
+        contents, config = self.request(sentences, sentences=True)
+        response = await self.client.aio.models.generate_content(model=self.model, contents=contents, config=config)
+        return self.parse_sentences(response.text)
+
+    async def warm_up_async(self):
+        # A model lookup is free and opens the connection a correction will reuse
+        await self.client.aio.models.get(model=self.model)
+
+
+class LocalRuleBackend(CorrectionBackend):
+    """Offline rule-based corrector for common typos, doubled words, capitalization, spacing and punctuation.
+
+    URLs, email addresses and code-like tokens are left alone, and the first
+    word is never capitalized because the selection may start mid-sentence.
+    """
+
+    name = "local"
+    model = "local-rules"
+
+    WORD = re.compile(r"\b[A-Za-z]+\b")
+    DOUBLED_WORD = re.compile(r"\b([A-Za-z]+)([ \t]+)\1\b", re.IGNORECASE)
+    EXTRA_SPACES = re.compile(r"(?<=\S)[ \t]{2,}(?=\S)")
+    SPACE_BEFORE_PUNCTUATION = re.compile(r"[ \t]+([,.;:!?])")
+    REPEATED_PUNCTUATION = re.compile(r"([,;:])\1+")
+    # URLs, emails, paths and tokens with code operators: "https://a.b/?q=a,b", "me@x.org", "x=1", "snake_case"
+    PROTECTED = re.compile(r"(\S*(?:://|www\.|@|[/\\=<>{}\[\]_|~^*#$%&+`])\S*)")
+    # Only between words ("hello,world"), not in "a,b,c" or "a!b"
+    MISSING_SPACE_AFTER = re.compile(r"(?<=[A-Za-z]{2})([,;!?])(?=[A-Za-z]{2})")
+    MISSING_SPACE_AFTER_PERIOD = re.compile(r"(?<=[a-z]{2})\.(?=[A-Z][a-z])")
+    # Sentence ends after a lowercase word or digit, but not after abbreviations like "U.S." or "e.g."
+    # (others, like "etc.", are in ABBREVIATIONS)
+    SENTENCE_START = re.compile(r"((?<=[a-z0-9)\"'!?])(?<!\.[a-z])[.!?][ \t]+)([a-z])")
+    LAST_WORD = re.compile(r"([A-Za-z]+)$")
+    LONE_I = re.compile(r"(?<!\.)\bi\b(?!\.)")  # Not the "i" of "i.e."
+
+    def correct(self, text, on_partial=None, on_latency=None):
+        # Protected tokens end up at the odd indices and are kept as they are
+        parts = self.PROTECTED.split(text)
+        return "".join(part if index % 2 else self._correct_prose(part) for index, part in enumerate(parts))
+
+    def _correct_prose(self, text):
+        corrected = self.WORD.sub(self._fix_typo, text)
+        corrected = self.DOUBLED_WORD.sub(self._fix_doubled_word, corrected)
+        corrected = self.EXTRA_SPACES.sub(" ", corrected)
+        corrected = self.SPACE_BEFORE_PUNCTUATION.sub(r"\1", corrected)
+        corrected = self.REPEATED_PUNCTUATION.sub(r"\1", corrected)
+        corrected = self.MISSING_SPACE_AFTER.sub(r"\1 ", corrected)
+        corrected = self.MISSING_SPACE_AFTER_PERIOD.sub(". ", corrected)
+        corrected = self.LONE_I.sub("I", corrected)
+        corrected = self.SENTENCE_START.sub(self._capitalize_sentence, corrected)
+        return corrected
+
+    def _capitalize_sentence(self, match):
+        if match.group(1)[0] == ".":
+            word = self.LAST_WORD.search(match.string, 0, match.start())
+            if word and word.group(1).lower() in ABBREVIATIONS:
+                return match.group(0)
+        return match.group(1) + match.group(2).upper()
+
+    @staticmethod
+    def _fix_typo(match):
+        word = match.group(0)
+        fixed = COMMON_TYPOS.get(word.lower())
+        if fixed is None:
+            return word
+        if word.isupper() and len(word) > 1:
+            return fixed.upper()
+        if word[0].isupper():
+            return fixed[0].upper() + fixed[1:]
+        return fixed
+
+    @staticmethod
+    def _fix_doubled_word(match):
+        word = match.group(1)
+        if word.lower() in ALLOWED_DOUBLED_WORDS:
+            return match.group(0)
+        return word
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of request latencies in seconds that gradually forgets old samples"""
+
+    BOUNDS = [0.01 * 1.2 ** i for i in range(60)]  # 10 ms to about nine minutes
+
+    def __init__(self, half_life=HISTOGRAM_HALF_LIFE):
+        self.half_life = half_life
+        self.counts = [0.0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.updated_at = time.perf_counter()
+        self._since_decay = 0
+
+    def record(self, seconds):
+        self.updated_at = time.perf_counter()
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += 1
+        self._since_decay += 1
+        if self._since_decay >= self.half_life:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+            self._since_decay = 0
+
+    def quantile(self, q):
+        """Upper bound in seconds of the bucket holding the q-quantile, or None when empty"""
+        if not self.total:
+            return None
+        target = q * self.total
+        running = 0.0
+        for index, count in enumerate(self.counts):
+            running += count
+            if count and running >= target:
+                return self.BOUNDS[min(index, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+
+class AdaptiveBackend(CorrectionBackend):
+    """Routes requests between models and adds timeouts and hedged requests, all from live latency histograms.
+
+    Latencies are kept per model and request size class. Each request goes to
+    the first model in routes that accepts its size and whose recent p95 for
+    that size is within ROUTING_P95_BUDGETS. Once a size class has
+    HEDGE_MIN_SAMPLES, a request still running at the percentile matching
+    HEDGE_BUDGET (p90 for 0.1) gets a duplicate and the first answer wins. A
+    token bucket keeps hedges within the budget (allowing bursts of
+    HEDGE_BURST), and requests outliving a multiple of the p99 time out.
+    Failed and cancelled requests are recorded with the time they ran, so
+    a model that stops answering doesn't keep its fast percentiles.
+    """
+
+    def __init__(self, routes, hedging=HEDGING, hedge_model=HEDGE_MODEL, budget=HEDGE_BUDGET, limiter=None):
+        # routes: [(backend, max_tokens or None)], in order of preference
+        self.routes = list(routes)
+        self.primary = self.routes[0][0]
+        self.name = self.primary.name
+        self.model = self.primary.model
+        self.backends = {backend.model: backend for backend, _ in self.routes}
+        self.hedging = hedging
+        self.hedge_model = hedge_model
+        self.budget = budget
+        self.limiter = limiter  # Hedges are only sent when the rate limit has room right away
+        self.histograms = {}
+        self.hedge_tokens = 1.0
+        self.stats = Counter()
+        self.routed = Counter()
+        self._lock = threading.Lock()
+
+    def histogram(self, model, tokens):
+        """Histogram for a model and the size class of a request; call with the lock held"""
+        key = (model, bisect.bisect_left(LATENCY_SIZE_CLASSES, tokens))
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        return self.histograms[key]
+
+    def route(self, tokens):
+        """Pick the backend for a request of this size; call with the lock held. Returns (backend, reason)"""
+        size = bisect.bisect_left(LATENCY_SIZE_CLASSES, tokens)
+        budget = ROUTING_P95_BUDGETS[min(size, len(ROUTING_P95_BUDGETS) - 1)]
+        candidates = [backend for backend, max_tokens in self.routes if max_tokens is None or tokens <= max_tokens]
+        over_budget = []
+        for backend in candidates or [self.primary]:
+            histogram = self.histogram(backend.model, tokens)
+            if histogram.total < ROUTING_MIN_SAMPLES:
+                return backend, "not enough samples yet"
+            p95 = histogram.quantile(0.95)
+            if p95 <= budget:
+                return backend, f"p95 {p95 * 1000:.0f} ms within the {budget * 1000:.0f} ms budget"
+            age = time.perf_counter() - histogram.updated_at
+            if age > ROUTING_RETRY_AFTER:
+                # Its samples are stale; measure it afresh
+                self.histograms[(backend.model, size)] = LatencyHistogram()
+                return backend, f"retrying, p95 was {p95 * 1000:.0f} ms {age:.0f} s ago"
+            over_budget.append((p95, backend))
+        p95, backend = min(over_budget, key=lambda item: item[0])
+        return backend, f"all models over the {budget * 1000:.0f} ms budget, lowest p95 {p95 * 1000:.0f} ms"
+
+    def plan(self, tokens):
+        """Choose the backends for a new request; return (backend, hedge_backend, hedge_after, timeout).
+
+        hedge_after is None when the request should not be hedged.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            self.hedge_tokens = min(HEDGE_BURST, self.hedge_tokens + self.budget)
+            backend, reason = self.route(tokens)
+            self.routed[backend.model] += 1
+            hedge = self.backends.get(self.hedge_model, backend) if self.hedge_model else backend
+            histogram = self.histogram(backend.model, tokens)
+            if histogram.total < HEDGE_MIN_SAMPLES:
+                hedge_after, timeout = None, GEMINI_TIMEOUT
+            else:
+                timeout = histogram.quantile(TIMEOUT_PERCENTILE) * TIMEOUT_MULTIPLIER
+                timeout = min(GEMINI_TIMEOUT, max(MIN_TIMEOUT, timeout))
+                hedge_after = histogram.quantile(1 - self.budget) if self.hedging else None
+        deadline = DEADLINE.get()
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - time.perf_counter()))
+        print(f"Routing {tokens} tokens to {backend.model}: {reason}")
+        trace = CURRENT_TRACE.get()
+        if trace is not None:
+            trace.model = backend.model
+        return backend, hedge, hedge_after, timeout
+
+    def take_hedge(self):
+        """Spend from the hedge budget; False when it is used up"""
+        with self._lock:
+            if self.hedge_tokens < 1.0:
+                self.stats["hedges_over_budget"] += 1
+                return False
+            if self.limiter is not None and not self.limiter.try_acquire():
+                self.stats["hedges_rate_limited"] += 1
+                return False
+            self.hedge_tokens -= 1.0
+            self.stats["hedged"] += 1
+            return True
+
+    def record(self, backend, tokens, seconds):
+        with self._lock:
+            self.histogram(backend.model, tokens).record(seconds)
+
+    def _won(self, backend, index, value):
+        answered_by = ANSWERED_BY.get()
+        if answered_by is not None:
+            answered_by.add(backend.model)
+        if index:
+            with self._lock:
+                self.stats["hedge_wins"] += 1
+        return value
+
+    def _timed_out(self, timeout):
+        with self._lock:
+            self.stats["timeouts"] += 1
+        return TimeoutError(f"{self.name} did not answer within {timeout:.1f} s")
+
+    async def _timed_async(self, attempt, backend, index, tokens):
+        # Failed and cancelled attempts are recorded too, with how long they ran (a lower bound for
+        # cancelled ones), or a model that times out would look fast from its few answers
+        started = time.perf_counter()
+        try:
+            return await attempt(backend, index)
+        finally:
+            self.record(backend, tokens, time.perf_counter() - started)
+
+    async def _race_async(self, tokens, attempt):
+        """Run attempt(backend, index) on the routed backend, hedging when it is slow; return the first answer.
+
+        The losing request is cancelled.
+        """
+        backend, hedge, hedge_after, timeout = self.plan(tokens)
+        started = time.perf_counter()
+        deadline = started + timeout
+        pending = {asyncio.ensure_future(self._timed_async(attempt, backend, 0, tokens)): 0}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= deadline:
+                    raise self._timed_out(timeout)
+                wait = deadline - now
+                if hedge_after is not None and not hedged:
+                    wait = min(wait, max(0.0, started + hedge_after - now))
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is None:
+                        return self._won((backend, hedge)[index], index, task.result())
+                    error = task.exception()
+                if (pending and hedge_after is not None and not hedged
+                        and time.perf_counter() - started >= hedge_after):
+                    hedged = True
+                    if self.take_hedge():
+                        pending[asyncio.ensure_future(self._timed_async(attempt, hedge, 1, tokens))] = 1
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def _partials(state, index, on_partial):
+        """Pass on partial results from whichever request streams first, until the race is decided"""
+        if on_partial is None:
+            return None
+
+        def forward(partial):
+            if state["done"]:
+                return
+            if state["leader"] is None:
+                state["leader"] = index
+            if state["leader"] == index:
+                on_partial(partial)
+
+        return forward
+
+    async def correct_async(self, text, on_partial=None, on_latency=None):
+        state = {"leader": None, "done": False}
+
+        async def attempt(backend, index):
+            streams = []
+            corrected = await backend.correct_async(text, self._partials(state, index, on_partial), streams.append)
+            return corrected, (streams[0] if streams else None)
+
+        try:
+            corrected, stream = await self._race_async(estimate_tokens(text), attempt)
+        finally:
+            state["done"] = True
+        if on_latency and stream is not None:
+            on_latency(stream)
+        return corrected
+
+    async def correct_sentences_async(self, sentences):
+        if not sentences:
+            return []
+        return await self._race_async(
+            estimate_tokens(" ".join(sentences)), lambda backend, index: backend.correct_sentences_async(sentences)
+        )
+
+    def cache_prompt(self, sentences=False):
+        return self.primary.cache_prompt(sentences)
+
+    async def warm_up_async(self):
+        await self.primary.warm_up_async()
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            routed = self.routed.most_common()
+        lines = [f"Hedging: {stats.get('hedged', 0)} of {stats.get('requests', 0)} requests hedged, "
+                 f"{stats.get('hedge_wins', 0)} won by the hedge, {stats.get('timeouts', 0)} timed out"]
+        if routed:
+            lines.append("Models: " + ", ".join(f"{model.split('/')[-1]} {count}" for model, count in routed))
+        return "\n".join(lines)
+
+
+class RateLimitExceeded(RuntimeError):
+    """The client-side rate limit would delay a request past its deadline"""
+
+
+class BackendUnavailable(RuntimeError):
+    """The circuit breaker is open after repeated failures"""
+
+
+class MissingApiKeyError(RuntimeError):
+    """The Gemini backend was asked for without an API key"""
+
+
+def error_status(error):
+    """HTTP status code of a genai API error, or None"""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error):
+    """Whether a failed request is worth retrying: throttling, server errors, timeouts and network failures"""
+    if error_status(error) in RETRY_STATUS_CODES:
+        return True
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, httpx.TransportError)
+
+
+def is_unhealthy(error):
+    """Whether a failure says the backend is down rather than busy (429) or rejecting the request (4xx)"""
+    return is_retryable(error) and error_status(error) != 429
+
+
+class TokenBucket:
+    """Client-side rate limiter; reserve() hands out send times so callers wait without holding the lock"""
+
+    def __init__(self, per_minute=RATE_LIMIT_RPM, burst=RATE_LIMIT_BURST):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.perf_counter()
+        self.throttled = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait):
+        """Take a token; return the seconds to wait before sending, or None if that would exceed max_wait"""
+        with self._lock:
+            self._refill(time.perf_counter())
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                self.rejected += 1
+                return None
+            self.tokens -= 1  # May go negative: later callers queue behind this reservation
+            if wait:
+                self.throttled += 1
+            return wait
+
+    def available(self):
+        """Requests that could be sent right now without waiting"""
+        with self._lock:
+            self._refill(time.perf_counter())
+            return max(0.0, self.tokens)
+
+    def try_acquire(self):
+        """Take a token only if one is available right now"""
+        with self._lock:
+            self._refill(time.perf_counter())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def summary(self):
+        tokens = self.available()
+        return (f"Rate limit: {tokens:.1f}/{self.capacity:.0f} requests available, "
+                f"{self.throttled} delayed, {self.rejected} rejected")
+
+
+class CircuitBreaker:
+    """Fails fast after repeated backend failures and lets one trial request through after a cooldown"""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.trial_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.perf_counter()
+            if self.state == "open" and now - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+                print("Circuit breaker half-open, sending a trial request")
+            if self.state == "half-open" and (self.trial_at is None or now - self.trial_at >= self.cooldown):
+                self.trial_at = now
+                return True
+            return False
+
+    def retry_in(self):
+        """Seconds until the next trial request may be sent"""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            since = self.trial_at if self.state == "half-open" else self.opened_at
+            return max(0.0, self.cooldown - (time.perf_counter() - since))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print("Circuit breaker closed, backend is healthy again")
+            self.state = "closed"
+            self.failures = 0
+            self.trial_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.state = "open"
+                self.opened_at = time.perf_counter()
+                self.trial_at = None
+                self.trips += 1
+                print(f"Circuit breaker open after {self.failures} failures, failing fast for {self.cooldown:.0f} s")
+
+    def summary(self):
+        with self._lock:
+            return f"Circuit breaker: {self.state} ({self.failures} recent failures, tripped {self.trips} times)"
+
+
+class ResilientBackend(CorrectionBackend):
+    """Wraps a backend with a client-side rate limit, retries with jittered backoff and a circuit breaker.
+
+    Each correction gets REQUEST_DEADLINE seconds in total. Waiting for the
+    rate limit, backing off and the requests themselves all count against it,
+    and wrapped AdaptiveBackends shorten their timeouts to fit (see DEADLINE).
+    """
+
+    def __init__(self, backend, limiter=None, breaker=None, deadline=REQUEST_DEADLINE, rng=None):
+        self.backend = backend
+        self.name = backend.name
+        self.model = backend.model
+        self.limiter = limiter or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.deadline = deadline
+        self.rng = rng or random.Random()
+        self.retries = 0
+
+    def _admit(self, deadline):
+        """Return the seconds to wait before sending, or raise if the request must not be sent"""
+        if not self.breaker.allow():
+            raise BackendUnavailable(
+                f"{self.name} is unavailable after repeated failures, retrying in {self.breaker.retry_in():.0f} s"
+            )
+        wait = self.limiter.reserve(deadline - time.perf_counter())
+        if wait is None:
+            raise RateLimitExceeded(f"Too many corrections at once (limit {RATE_LIMIT_RPM} per minute)")
+        return wait
+
+    def _failed(self, error, attempt, deadline):
+        """Record a failure; return the backoff before retrying, or None to give up"""
+        if is_unhealthy(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()  # It answered, just not with a correction
+        if not is_retryable(error) or attempt + 1 >= RETRY_ATTEMPTS:
+            return None
+        delay = self.rng.uniform(0, min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2 ** attempt))
+        if time.perf_counter() + delay >= deadline:
+            return None
+        self.retries += 1
+        print(f"{self.name} request failed ({str(error)}), retrying in {delay * 1000:.0f} ms")
+        return delay
+
+    async def _call_async(self, call):
+        deadline = time.perf_counter() + self.deadline
+        token = DEADLINE.set(deadline)
+        try:
+            attempt = 0
+            while True:
+                await asyncio.sleep(self._admit(deadline))
+                try:
+                    result = await call()
+                except Exception as e:
+                    delay = self._failed(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.breaker.record_success()
+                return result
+        finally:
+            DEADLINE.reset(token)
+
+    async def correct_async(self, text, on_partial=None, on_latency=None):
+        return await self._call_async(lambda: self.backend.correct_async(text, on_partial, on_latency))
+
+    async def correct_sentences_async(self, sentences):
+        if not sentences:
+            return []
+        return await self._call_async(lambda: self.backend.correct_sentences_async(sentences))
+
+    def cache_prompt(self, sentences=False):
+        return self.backend.cache_prompt(sentences)
+
+    async def warm_up_async(self):
+        await self.backend.warm_up_async()
+
+    def summary(self):
+        lines = [self.limiter.summary(), f"{self.breaker.summary()}, {self.retries} retries"]
+        inner = self.backend.summary()
+        if inner:
+            lines.append(inner)
+        return "\n".join(lines)
+
+
+class SystemClipboard:
+    """The OS clipboard, through pyperclip"""
+
+    on_read = None  # Called when another application reads text we copied, where the platform tells us (X11)
+
+    def paste(self):
+        return pyperclip.paste()
+
+    def copy(self, text):
+        pyperclip.copy(text)
+
+    def sequence_number(self):
+        return clipboard_sequence_number()
+
+
+class MacClipboard(SystemClipboard):
+    """The macOS general pasteboard through AppKit, without a pbcopy/pbpaste process per call"""
+
+    def __init__(self):
+        from AppKit import NSPasteboard, NSPasteboardTypeString
+        self.pasteboard = NSPasteboard.generalPasteboard()
+        self.string_type = NSPasteboardTypeString
+
+    def paste(self):
+        text = self.pasteboard.stringForType_(self.string_type)
+        return "" if text is None else str(text)
+
+    def copy(self, text):
+        self.pasteboard.clearContents()
+        if not self.pasteboard.setString_forType_(text, self.string_type):
+            super().copy(text)
+
+    def sequence_number(self):
+        return self.pasteboard.changeCount()
+
+
+class X11Clipboard(SystemClipboard):
+    """The X11 CLIPBOARD selection through python-xlib, without an xclip/xsel process per call.
+
+    Copying makes a hidden window the clipboard owner and a thread answers
+    other applications' requests for the text, like xclip's background
+    process does. Pasting asks the current owner directly, or answers from
+    our own text. XFixes owner-change events count clipboard changes, so
+    sequence_number() is as cheap as on Windows and macOS. Texts too large
+    for one X request, incremental (INCR) transfers and owners that don't
+    answer fall back to pyperclip. Text the app owns is gone once it exits.
+
+    The thread sleeps in select() until the X server or a self-pipe has
+    something. Xlib calls on other threads can read our events off the
+    socket into Xlib's queue, so those calls write to the pipe to have the
+    queue drained.
+    """
+
+    ATOMS = ("CLIPBOARD", "UTF8_STRING", "TEXT", "TARGETS", "INCR", "SSG_CLIPBOARD")
+    FALLBACK = object()  # Reply that pyperclip has to handle
+
+    def __init__(self, display_name=None):
+        self.display = xdisplay.Display(display_name)
+        self.window = self.display.screen().root.create_window(0, 0, 1, 1, 0, X.CopyFromParent)
+        self.atoms = {name: self.display.intern_atom(name) for name in self.ATOMS}
+        self.max_bytes = self.display.display.info.max_request_length * 4 - 64
+        self.text = None  # What we hand out while we own the clipboard
+        self.sequence = None
+        self.xfixes_event = None
+        if self.display.has_extension("XFIXES"):
+            self.display.xfixes_query_version()
+            mask = 0b111  # Owner set, owner window destroyed, owner client gone
+            self.display.xfixes_select_selection_input(self.window, self.atoms["CLIPBOARD"], mask)
+            self.xfixes_event = self.display.extension_event.SetSelectionOwnerNotify[0]
+            self.sequence = 0
+        self._reply = None
+        self._replied = threading.Event()
+        self._lock = threading.Lock()
+        self._request_lock = threading.Lock()  # One paste request at a time
+        self._closing = False
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_write, False)
+        self.display.sync()
+        self.thread = threading.Thread(target=self._serve, name="X11Clipboard", daemon=True)
+        self.thread.start()
+
+    def paste(self):
+        with self._lock:
+            if self.text is not None:
+                return self.text
+        with self._request_lock:
+            self._replied.clear()
+            self.window.convert_selection(self.atoms["CLIPBOARD"], self.atoms["UTF8_STRING"],
+                                          self.atoms["SSG_CLIPBOARD"], X.CurrentTime)
+            self.display.flush()
+            self._wake()
+            reply = self._reply if self._replied.wait(X11_SELECTION_TIMEOUT) else self.FALLBACK
+        return super().paste() if reply is self.FALLBACK else reply
+
+    def copy(self, text):
+        if len(text.encode("utf-8")) > self.max_bytes:
+            with self._lock:
+                self.text = None
+            return super().copy(text)
+        with self._lock:
+            self.text = text
+        self.window.set_selection_owner(self.atoms["CLIPBOARD"], X.CurrentTime)
+        owner = self.display.get_selection_owner(self.atoms["CLIPBOARD"])
+        self._wake()
+        if owner != self.window:
+            with self._lock:
+                self.text = None
+            super().copy(text)
+
+    def sequence_number(self):
+        with self._lock:
+            return self.sequence
+
+    def close(self):
+        """Stop the serving thread; text the app still owns is no longer handed out"""
+        self._closing = True
+        self._wake()
+        self.thread.join(timeout=2)
+        os.close(self._wake_write)
+        self.display.close()
+
+    def _wake(self):
+        """Have the serving thread look at Xlib's event queue again"""
+        try:
+            os.write(self._wake_write, b"x")
+        except (BlockingIOError, OSError):
+            pass  # Closed, or full of wakeups it hasn't read yet
+
+    def _serve(self):
+        """Answer other applications and collect our own paste replies until close()"""
+        while not self._closing:
+            try:
+                while self.display.pending_events():
+                    self._handle(self.display.next_event())
+            except xerror.ConnectionClosedError as e:
+                print(f"X11 clipboard stopped: {str(e)}")
+                break
+            except Exception as e:
+                print(f"X11 clipboard error: {str(e)}")
+            readable, _, _ = select.select([self.display, self._wake_read], [], [])
+            if self._wake_read in readable:
+                os.read(self._wake_read, 4096)
+        os.close(self._wake_read)
+
+    def _handle(self, event):
+        if event.type == X.SelectionRequest:
+            self._answer(event)
+        elif event.type == X.SelectionNotify and event.requestor == self.window:
+            self._reply = self._read_reply(event.property)
+            self._replied.set()
+        elif event.type == X.SelectionClear:
+            # Another application copied something, unless we have taken the clipboard back since
+            if self.display.get_selection_owner(self.atoms["CLIPBOARD"]) != self.window:
+                with self._lock:
+                    self.text = None
+        elif event.type == self.xfixes_event:
+            with self._lock:
+                self.sequence += 1
+
+    def _read_reply(self, prop):
+        if prop == X.NONE:
+            return ""  # Nobody owns the clipboard, or the owner has no text
+        value = self.window.get_full_property(prop, X.AnyPropertyType, sizehint=65536)
+        self.window.delete_property(prop)
+        if value is None or value.format != 8 or value.property_type == self.atoms["INCR"]:
+            return self.FALLBACK
+        text = value.value
+        return text.decode("utf-8", "replace") if isinstance(text, bytes) else str(text)
+
+    def _answer(self, request):
+        with self._lock:
+            text = self.text
+        prop = request.property or request.target  # Obsolete clients leave the property empty
+        if text is None:
+            prop = X.NONE
+        elif request.target == self.atoms["TARGETS"]:
+            targets = [self.atoms["TARGETS"], self.atoms["UTF8_STRING"], self.atoms["TEXT"], Xatom.STRING]
+            request.requestor.change_property(prop, Xatom.ATOM, 32, targets)
+        elif request.target in (self.atoms["UTF8_STRING"], self.atoms["TEXT"]):
+            request.requestor.change_property(prop, self.atoms["UTF8_STRING"], 8, text.encode("utf-8"))
+        elif request.target == Xatom.STRING:
+            request.requestor.change_property(prop, Xatom.STRING, 8, text.encode("latin-1", "replace"))
+        else:
+            prop = X.NONE
+        notify = xevent.SelectionNotify(time=request.time, requestor=request.requestor,
+                                        selection=request.selection, target=request.target, property=prop)
+        request.requestor.send_event(notify)
+        self.display.flush()
+        if prop != X.NONE and request.target != self.atoms["TARGETS"] and self.on_read:
+            self.on_read()
+
+
+def system_clipboard():
+    """Clipboard access for this platform: in-process where possible, pyperclip otherwise"""
+    # pyperclip already calls the Win32 API in-process on Windows
+    if NATIVE_CLIPBOARD:
+        try:
+            if sys.platform == "darwin":
+                return MacClipboard()
+            if (sys.platform.startswith("linux") and os.environ.get("DISPLAY")
+                    and not os.environ.get("WAYLAND_DISPLAY")):
+                return X11Clipboard()
+        except Exception as e:
+            print(f"In-process clipboard unavailable ({str(e)}), using pyperclip")
+    return SystemClipboard()
+
+
+class ClipboardRestorer:
+    """Puts the user's clipboard back after pasted corrections, from one thread for the whole app.
+
+    Corrections that overlap share one restore: begin() holds it while a
+    correction copies the selection and hands back the clipboard text from
+    before the first of them, and each paste pushes the restore back, so the
+    user's text is put back once, after the last paste, and never over a
+    newer correction. The restore happens CLIPBOARD_RESTORE_DELAY after the
+    paste, or CLIPBOARD_RESTORE_AFTER_READ after another application read
+    the pasted text where the clipboard reports reads (X11). It is skipped
+    when something else was copied in the meantime.
+    """
+
+    HOLD_POLL = 0.05  # Seconds between checks while a correction that may paste is still running
+
+    def __init__(self, clipboard):
+        self.clipboard = clipboard
+        self.original = None  # The user's clipboard, put back after the last paste
+        self.pasted = None  # What the last paste put on the clipboard, and its sequence number
+        self.sequence = None
+        self.due = None  # perf_counter() time of the pending restore
+        self.read = False
+        self.trace = None  # Finished when the clipboard is restored
+        self.holders = set()  # Traces of corrections between copying the selection and pasting
+        self.restored = self.early = self.superseded = self.skipped = 0
+        self.thread = None
+        self._closing = False
+        self._changed = threading.Condition()
+        if hasattr(clipboard, "on_read"):
+            clipboard.on_read = self.pasted_text_read
+
+    def begin(self, trace=None):
+        """Hold the pending restore while a correction copies the selection.
+
+        Returns (the clipboard text now, the text to restore after the paste).
+        """
+        with self._changed:
+            self.holders = {holder for holder in self.holders if not holder.done.is_set()}
+            try:
+                current = self.clipboard.paste()
+            except:
+                current = ""
+            if self.pasted is None and not self.holders:
+                self.original = current  # Nothing of ours on the clipboard
+            elif self.pasted is not None and self._changed_since_paste(current):
+                self._finish(skipped=True)  # The user copied something new; that is what to keep
+                self.original = current
+            if trace is not None:
+                self.holders.add(trace)
+            return current, self.original
+
+    def schedule(self, pasted_text, trace=None):
+        """Restore the clipboard after pasted_text, replacing any restore that is still pending"""
+        sequence = self.clipboard.sequence_number()
+        with self._changed:
+            self.holders.discard(trace)
+            if self.trace is not None:
+                self.superseded += 1
+                self.trace.finish()  # Its restore is now this paste's
+            self.pasted = pasted_text
+            self.sequence = sequence
+            self.trace = trace
+            self.read = False
+            self.due = time.perf_counter() + CLIPBOARD_RESTORE_DELAY
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="ClipboardRestorer", daemon=True)
+                self.thread.start()
+            self._changed.notify_all()
+
+    def pasted_text_read(self):
+        """Another application has read our clipboard text: the paste has been consumed"""
+        with self._changed:
+            if self.due is not None and not self.read:
+                self.read = True
+                self.due = min(self.due, time.perf_counter() + CLIPBOARD_RESTORE_AFTER_READ)
+                self._changed.notify_all()
+
+    def close(self, timeout=2.0):
+        """Restore the clipboard now if a restore is pending and stop the thread"""
+        with self._changed:
+            self._closing = True
+            self._changed.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def summary(self):
+        """One line for the stats panel"""
+        return (f"Clipboard restores: {self.restored} ({self.early} early), "
+                f"{self.superseded} superseded, {self.skipped} skipped")
+
+    def _run(self):
+        with self._changed:
+            while True:
+                if self.due is None:
+                    if self._closing:
+                        return
+                    self._changed.wait()
+                    continue
+                self.holders = {holder for holder in self.holders if not holder.done.is_set()}
+                if self.holders and not self._closing:
+                    self._changed.wait(self.HOLD_POLL)  # Its paste will push the restore back
+                    continue
+                remaining = self.due - time.perf_counter()
+                if remaining > 0 and not self._closing:
+                    self._changed.wait(remaining)
+                    continue
+                self._restore()
+
+    def _restore(self):
+        try:
+            if self.original is not None and not self._changed_since_paste(self.clipboard.paste()):
+                self.clipboard.copy(self.original)
+                self.restored += 1
+                self.early += self.read
+                return self._finish()
+        except Exception as e:
+            print(f"Clipboard restore failed: {str(e)}")
+        self._finish(skipped=True)
+
+    def _changed_since_paste(self, current):
+        """Whether something other than our paste is on the clipboard"""
+        if self.sequence is not None and self.clipboard.sequence_number() == self.sequence:
+            return False
+        return current != self.pasted
+
+    def _finish(self, skipped=False):
+        self.skipped += skipped
+        if self.trace is not None:
+            self.trace.finish()
+        self.original = self.pasted = self.sequence = self.due = self.trace = None
+        self.read = False
+
+
+class SystemKeys:
+    """Synthesizes shortcuts in the focused application and reads the keyboard state.
+
+    Which way of injecting a shortcut reaches other applications depends on
+    the OS, the session and its permissions, and a method that doesn't
+    raise may still do nothing. The method whose Ctrl+C was seen to change
+    the clipboard, or to reach the app's own window at startup, is
+    remembered per session in INPUT_METHOD_PATH and used on its own. Until one is known, or after INPUT_REPROBE_AFTER copies in a
+    row changed nothing, copy_selection() tries the METHODS in order, within
+    INPUT_REPROBE_TIMEOUT together. When none of them copies either, most
+    likely nothing was selected, so twice as many failed copies are needed
+    before the next try.
+    """
+
+    METHODS = ("keyboard", "pyautogui", "pyautogui-keys")
+
+    def __init__(self, path=INPUT_METHOD_PATH):
+        self.path = path
+        self.method = self._load()  # Verified to copy in this session; None until one is
+        self.failures = 0  # Copies in a row that didn't change the clipboard
+        self.reprobe_after = INPUT_REPROBE_AFTER  # Failures before the other methods are tried
+
+    def send_shortcut(self, key, method=None):
+        """Press Ctrl+key (Cmd+key on macOS); return the method used, or None if every one raised
+
+        Uses method, else the remembered method, else the first of METHODS that doesn't raise.
+        """
+        if method is not None:
+            methods = (method,)
+        else:
+            methods = sorted(self.METHODS, key=lambda name: name != self.method)
+        for name in methods:
+            try:
+                getattr(self, "_send_" + name.replace("-", "_"))(key)
+                return name
+            except Exception as e:
+                print(f"Sending Ctrl+{key} with {name} failed: {str(e)}")
+        return None
+
+    def copy_selection(self, copied):
+        """Send Ctrl+C and return whether copied(timeout) (which waits for the clipboard to change) saw it arrive.
+
+        timeout is None for the usual wait; when several methods are tried it
+        is what is left of INPUT_REPROBE_TIMEOUT.
+        """
+        if self.method is not None and self.failures < self.reprobe_after:
+            if self.send_shortcut("c", self.method) and copied(None):
+                self.confirm(self.method)
+                return True
+            self.failures += 1  # Nothing selected, or the method stopped working
+            return False
+        deadline = time.perf_counter() + INPUT_REPROBE_TIMEOUT
+        for method in sorted(self.METHODS, key=lambda name: name != self.method):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            if self.send_shortcut("c", method) and copied(remaining):
+                self.confirm(method)
+                return True
+        if self.method is not None:
+            # No method copied anything, so probably there was nothing to copy
+            self.failures = 0
+            self.reprobe_after *= 2
+        return False
+
+    def confirm(self, method):
+        """Remember method as the one that works in this session"""
+        self.failures = 0
+        self.reprobe_after = INPUT_REPROBE_AFTER
+        if method == self.method:
+            return
+        print(f"Input method: {method}")
+        self.method = method
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            methods = self._read()
+            methods[self.session()] = method
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(methods, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save the input method: {str(e)}")
+
+    def session(self):
+        """What the remembered method is keyed on: the platform and, on Linux, the session type and desktop"""
+        parts = (sys.platform, os.environ.get("XDG_SESSION_TYPE", ""), os.environ.get("XDG_CURRENT_DESKTOP", ""))
+        return "/".join(part for part in parts if part)
+
+    def summary(self):
+        """One line for the stats panel"""
+        if self.method is None:
+            return f"Input: not verified yet (trying {', '.join(self.METHODS)})"
+        retrying = f" ({self.failures} copies in a row changed nothing)" if self.failures else ""
+        return f"Input: {self.method}{retrying}"
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                methods = json.load(f)
+            return methods if isinstance(methods, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        method = self._read().get(self.session())
+        return method if method in self.METHODS else None
+
+    def _send_keyboard(self, key):
+        if sys.platform == "darwin":  # macOS
+            keyboard.send(f'cmd+{key}')
+        else:  # Windows/Linux
+            keyboard.send(f'ctrl+{key}')
+
+    def _send_pyautogui(self, key):
+        if sys.platform == "darwin":  # macOS
+            pyautogui.hotkey('command', key)
+        else:  # Windows/Linux
+            pyautogui.hotkey('ctrl', key)
+
+    def _send_pyautogui_keys(self, key):
+        # Individual key presses with delays, for applications that miss pyautogui.hotkey
+        modifier = 'command' if sys.platform == "darwin" else 'ctrl'
+        pyautogui.keyDown(modifier)
+        time.sleep(0.05)
+        pyautogui.press(key)
+        time.sleep(0.05)
+        pyautogui.keyUp(modifier)
+
+    def is_pressed(self, hotkey):
+        return keyboard.is_pressed(hotkey)
+
+    def foreground_app(self):
+        return foreground_app_name()
+
+    def read_selection(self):
+        """The highlighted text, when the platform can read it without copying; None otherwise"""
+        return None
+
+
+class X11Keys(SystemKeys):
+    """Linux/X11 input through python-xlib: the PRIMARY selection is read directly and shortcuts are typed with XTest.
+
+    Highlighting text on X11 makes it the PRIMARY selection, so it can be
+    requested from its owner without sending Ctrl+C and polling the
+    clipboard. Browsers, terminals and others keep owning PRIMARY after the
+    highlight is gone, so it is only used when the focused application owns
+    it, took it less than X11_SELECTION_MAX_AGE ago (by its TIMESTAMP) and
+    it isn't the selection captured last time; otherwise read_selection()
+    returns None and the app copies with Ctrl+C, which finds out whether
+    anything is highlighted.
+    """
+
+    KEYSYM_NAMES = {"ctrl": "Control_L", "shift": "Shift_L", "alt": "Alt_L", "cmd": "Super_L", "windows": "Super_L"}
+    ATOMS = ("PRIMARY", "UTF8_STRING", "TIMESTAMP", "INCR", "SSG_SELECTION", "SSG_TIME", "_NET_ACTIVE_WINDOW",
+             "_NET_WM_PID", "WM_CLIENT_LEADER")
+
+    METHODS = ("xtest",) + SystemKeys.METHODS
+
+    def __init__(self, display_name=None):
+        super().__init__()
+        self.display = xdisplay.Display(display_name)
+        if not self.display.has_extension("XTEST"):
+            raise RuntimeError("the X server has no XTEST extension")
+        self.root = self.display.screen().root
+        # Receives the selection and tells the server time (PropertyNotify); never mapped
+        self.window = self.root.create_window(0, 0, 1, 1, 0, X.CopyFromParent, event_mask=X.PropertyChangeMask)
+        self.atoms = {name: self.display.intern_atom(name) for name in self.ATOMS}
+        self.last_selection = None  # (owner, timestamp) of the selection read last time
+        self._lock = threading.Lock()  # One request/reply exchange with the X server at a time
+
+    def read_selection(self):
+        """Return the highlighted text of the focused application, or None to copy it with Ctrl+C instead"""
+        try:
+            with self._lock:
+                owner = self.display.get_selection_owner(self.atoms["PRIMARY"])
+                focused = self._focused_window()
+                if not getattr(owner, "id", None) or focused is None or not self._same_application(owner, focused):
+                    return None
+                if not self._fresh(owner):
+                    return None
+                return self._selection_text()
+        except Exception as e:
+            print(f"Reading the PRIMARY selection failed: {str(e)}")
+            return None
+
+    def _fresh(self, owner):
+        """Whether owner took PRIMARY recently and it hasn't been captured already; records it as captured"""
+        stamp = self._convert_selection(self.atoms["TIMESTAMP"])
+        if stamp is None or stamp.format != 32 or not len(stamp.value) or not stamp.value[0]:
+            return False  # Owners that can't say when they got the selection are not trusted
+        selection = (owner.id, int(stamp.value[0]))
+        if selection == self.last_selection:
+            return False  # Pasting replaced it, or it is still highlighted; Ctrl+C tells which
+        now = self._server_time()
+        if now is None or ((now - selection[1]) & 0xFFFFFFFF) / 1000.0 > X11_SELECTION_MAX_AGE:
+            return False
+        self.last_selection = selection
+        return True
+
+    def _selection_text(self):
+        value = self._convert_selection(self.atoms["UTF8_STRING"])
+        if value is None or value.format != 8:
+            return None
+        text = value.value
+        return text.decode("utf-8", "replace") if isinstance(text, bytes) else str(text)
+
+    def _convert_selection(self, target):
+        """Ask the PRIMARY owner for target; return the reply property (None if refused or too slow)"""
+        self.window.convert_selection(self.atoms["PRIMARY"], target, self.atoms["SSG_SELECTION"], X.CurrentTime)
+        self.display.flush()
+        event = self._wait_for(lambda event: event.type == X.SelectionNotify
+                               and event.requestor.id == self.window.id and event.target == target)
+        if event is None or event.property == X.NONE:
+            return None
+        value = self.window.get_full_property(event.property, X.AnyPropertyType, sizehint=65536)
+        self.window.delete_property(event.property)
+        if value is None or value.property_type == self.atoms["INCR"]:
+            return None  # Huge selections arrive in pieces (INCR); leave those to Ctrl+C
+        return value
+
+    def _server_time(self):
+        """The X server's current time in milliseconds, from the PropertyNotify of an empty append"""
+        self.window.change_property(self.atoms["SSG_TIME"], Xatom.STRING, 8, b"", mode=X.PropModeAppend)
+        self.display.flush()
+        event = self._wait_for(lambda event: event.type == X.PropertyNotify
+                               and event.window.id == self.window.id and event.atom == self.atoms["SSG_TIME"])
+        return event.time if event is not None else None
+
+    def _wait_for(self, matches):
+        deadline = time.perf_counter() + X11_SELECTION_TIMEOUT
+        while True:
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if matches(event):
+                    return event
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            select.select([self.display], [], [], remaining)
+
+    def _focused_window(self):
+        active = self.root.get_full_property(self.atoms["_NET_ACTIVE_WINDOW"], X.AnyPropertyType)
+        if active is not None and len(active.value) and active.value[0]:
+            return self.display.create_resource_object("window", active.value[0])
+        focus = self.display.get_input_focus().focus  # No EWMH window manager, e.g. under Xvfb
+        return focus if getattr(focus, "id", None) else None
+
+    def _top_level(self, window):
+        """The ancestor of window that is a child of the root window"""
+        for _ in range(32):
+            parent = window.query_tree().parent
+            if not getattr(parent, "id", None) or parent.id == self.root.id:
+                break
+            window = parent
+        return window
+
+    def _identity(self, window):
+        """What ties a window to its application: top-level window, client leader, process id and WM_CLASS"""
+        top = self._top_level(window)
+        identity = {("window", top.id)}
+        for candidate in {window.id: window, top.id: top}.values():
+            for name in ("WM_CLIENT_LEADER", "_NET_WM_PID"):
+                value = candidate.get_full_property(self.atoms[name], X.AnyPropertyType)
+                if value is not None and len(value.value):
+                    identity.add((name, value.value[0]))
+            wm_class = candidate.get_wm_class()
+            if wm_class:
+                identity.add(("WM_CLASS", wm_class[1]))
+        return identity
+
+    def _same_application(self, owner, focused):
+        return bool(self._identity(owner) & self._identity(focused))
+
+    def _keycode(self, name):
+        name = self.KEYSYM_NAMES.get(name.lower(), name)
+        for candidate in (name, name.upper(), name.capitalize()):  # "f9" is the keysym "F9"
+            keysym = XK.string_to_keysym(candidate)
+            if keysym:
+                return self.display.keysym_to_keycode(keysym)
+        return 0
+
+    def _send_xtest(self, key):
+        with self._lock:
+            control, code = self._keycode("ctrl"), self._keycode(key)
+            if not (control and code):
+                raise RuntimeError(f"no keycode for ctrl+{key}")
+            for event_type, keycode in ((X.KeyPress, control), (X.KeyPress, code),
+                                        (X.KeyRelease, code), (X.KeyRelease, control)):
+                self.display.xtest_fake_input(event_type, keycode)
+            self.display.sync()
+
+    def is_pressed(self, hotkey):
+        """Whether every key of hotkey is held down, from the X server's keymap (no root needed)"""
+        with self._lock:
+            codes = [self._keycode(part) for part in hotkey.split("+")]
+            if not all(codes):
+                return super().is_pressed(hotkey)
+            keymap = self.display.query_keymap()
+        return all(keymap[code // 8] & (1 << (code % 8)) for code in codes)
+
+    def foreground_app(self):
+        try:
+            with self._lock:
+                focused = self._focused_window()
+                wm_class = self._top_level(focused).get_wm_class() if focused is not None else None
+        except Exception:
+            return "unknown"
+        return wm_class[1].lower() if wm_class else "unknown"
+
+
+def system_keys():
+    """Keyboard and selection access for this platform"""
+    # XTest can't reach native Wayland windows, so only plain X11 sessions get X11Keys
+    if (X11_INPUT and sys.platform.startswith("linux") and os.environ.get("DISPLAY")
+            and not os.environ.get("WAYLAND_DISPLAY")):
+        try:
+            return X11Keys()
+        except Exception as e:
+            print(f"X11 input unavailable ({str(e)}), using the keyboard library and Ctrl+C")
+    return SystemKeys()
+
+
+class HotkeySupervisor:
+    """Owns the global hotkey registration on a thread that sleeps until asked to change it.
+
+    start(), stop() and restart() only record the wanted state and wake the
+    thread, so they are safe to call from Tk, the tray menu or any other
+    thread. The thread keeps the handle of its single registration and
+    removes it before registering again, and close() joins it.
+    """
+
+    def __init__(self, hotkey, callback, prepare=None, on_error=None):
+        self.hotkey = hotkey
+        self.callback = callback
+        self.prepare = prepare  # Called on the supervisor thread before each registration
+        self.on_error = on_error
+        self.handle = None
+        self.thread = None
+        self._wanted = False
+        self._reregister = False
+        self._closing = False
+        self._pending = False
+        self._changed = threading.Condition()
+
+    def start(self):
+        """Register the hotkey (no-op if it already is)"""
+        self._request(wanted=True)
+
+    def stop(self):
+        """Remove the hotkey registration"""
+        self._request(wanted=False)
+
+    def restart(self):
+        """Remove and register the hotkey again, e.g. after the keyboard hook stopped working"""
+        self._request(wanted=True, reregister=True)
+
+    def close(self, timeout=2.0):
+        """Remove the registration and stop the supervisor thread"""
+        with self._changed:
+            self._closing = True
+            self._pending = True
+            self._changed.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _request(self, wanted, reregister=False):
+        with self._changed:
+            if self._closing:
+                return
+            self._wanted = wanted
+            self._reregister = self._reregister or reregister
+            self._pending = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="HotkeySupervisor", daemon=True)
+                self.thread.start()
+            self._changed.notify_all()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._pending)
+                self._pending = False
+                closing = self._closing
+                wanted = self._wanted and not closing
+                reregister = self._reregister
+                self._reregister = False
+            if self.handle is not None and (reregister or not wanted):
+                self._unregister()
+            if wanted and self.handle is None:
+                self._register()
+            if closing:
+                return
+
+    def _register(self):
+        try:
+            if self.prepare:
+                self.prepare()
+            self.handle = keyboard.add_hotkey(self.hotkey, self.callback)
+            print(f"Hotkey ready ({self.hotkey}) {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start")
+        except Exception as e:
+            print(f"Hotkey error: {str(e)}")
+            if self.on_error:
+                self.on_error(e)
+
+    def _unregister(self):
+        try:
+            keyboard.remove_hotkey(self.handle)
+        except (KeyError, ValueError) as e:
+            print(f"Hotkey was already removed: {str(e)}")
+        self.handle = None
+
+
+CURRENT_TRACE = contextvars.ContextVar("current_trace", default=None)
+DEADLINE = contextvars.ContextVar("deadline", default=None)  # perf_counter() time the current correction must end by
+ANSWERED_BY = contextvars.ContextVar("answered_by", default=None)  # Set collecting the models that answered, if any
+
+
+def mark_phase(phase, at=None, first=False):
+    """Timestamp a phase of the correction traced in the current context, if any"""
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.mark(phase, at, first)
+
+
+def run_in_context(function, *args):
+    """Wrap function so it runs with a copy of the current context (executors don't propagate it)"""
+    return functools.partial(contextvars.copy_context().run, function, *args)
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class CorrectionTrace:
+    """Timestamps of the phases of one hotkey-to-paste correction"""
+
+    PHASES = (
+        "hotkey", "copy_issued", "copied", "request_sent", "first_byte", "corrected", "pasted", "restored",
+    )
+    # Reported durations: name -> (start phase, end phase)
+    SPANS = {
+        "copy": ("hotkey", "copied"),
+        "model": ("copied", "corrected"),
+        "paste": ("corrected", "pasted"),
+        "restore": ("pasted", "restored"),
+        "total": ("hotkey", "restored"),
+        "hotkey_to_paste": ("hotkey", "pasted"),
+        "key_release": ("hotkey", "copy_issued"),
+        "clipboard_wait": ("copy_issued", "copied"),
+        "time_to_first_byte": ("request_sent", "first_byte"),
+        "response": ("first_byte", "corrected"),
+    }
+
+    def __init__(self, hotkey_at=None, recorder=None):
+        self.marks = {"hotkey": hotkey_at if hotkey_at is not None else time.perf_counter()}
+        self.error = None
+        self.model = None
+        self.recorder = recorder
+        self.done = threading.Event()
+
+    def mark(self, phase, at=None, first=False):
+        """Record when phase happened (now by default); first=True keeps an earlier mark"""
+        if first and phase in self.marks:
+            return
+        self.marks[phase] = at if at is not None else time.perf_counter()
+
+    def fail(self, error):
+        """Record an error and end the trace"""
+        self.error = error
+        self._end()
+
+    def finish(self):
+        self.mark("restored")
+        self._end()
+
+    def _end(self):
+        if self.done.is_set():
+            return
+        self.done.set()
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+    @property
+    def outcome(self):
+        if self.error is None:
+            return "ok"
+        if isinstance(self.error, str):
+            return self.error
+        return type(self.error).__name__
+
+    def durations(self):
+        """Seconds spent in each span whose start and end phases were reached"""
+        return {
+            name: self.marks[end] - self.marks[start]
+            for name, (start, end) in self.SPANS.items()
+            if start in self.marks and end in self.marks
+        }
+
+
+class LatencyRecorder:
+    """Keeps recent correction traces in a bounded ring buffer, optionally mirrored to a JSONL log"""
+
+    NOT_ERRORS = ("ok", "no selection", "coalesced", "superseded")
+
+    def __init__(self, size=TRACE_BUFFER_SIZE, log_path=TRACE_LOG_PATH):
+        self.records = deque(maxlen=size)
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            try:
+                self._log = open(log_path, "a", encoding="utf-8")
+            except OSError as e:
+                print(f"Can't open trace log {log_path}: {str(e)}")
+
+    def record(self, trace):
+        """Add a finished trace"""
+        entry = {
+            "time": time.time(),
+            "outcome": trace.outcome,
+            "durations_ms": {name: round(seconds * 1000, 3) for name, seconds in trace.durations().items()},
+        }
+        if trace.model:
+            entry["model"] = trace.model
+        if trace.error is not None and not isinstance(trace.error, str):
+            entry["error"] = str(trace.error)
+        with self._lock:
+            self.records.append(entry)
+            self.outcomes[entry["outcome"]] += 1
+            if self._log:
+                try:
+                    self._log.write(json.dumps(entry) + "\n")
+                    self._log.flush()
+                except (OSError, ValueError):
+                    pass
+
+    def percentiles(self, span, pcts=(50, 95, 99)):
+        """Rolling percentiles in milliseconds of a span over the buffered corrections, or None"""
+        with self._lock:
+            values = [r["durations_ms"][span] for r in self.records if span in r["durations_ms"]]
+        if not values:
+            return None
+        return {pct: percentile(values, pct) for pct in pcts}
+
+    def error_count(self):
+        with self._lock:
+            return sum(count for outcome, count in self.outcomes.items() if outcome not in self.NOT_ERRORS)
+
+    def correction_count(self):
+        with self._lock:
+            return self.outcomes["ok"]
+
+    def summary(self):
+        """Multi-line summary for the stats panel"""
+        lines = [f"Corrections: {self.correction_count()}   Errors: {self.error_count()}"]
+        for label, span in (("F9 to paste", "hotkey_to_paste"), ("Copy", "copy"),
+                            ("Model", "model"), ("First byte", "time_to_first_byte"), ("Paste", "paste")):
+            stats = self.percentiles(span)
+            if stats:
+                lines.append(
+                    f"{label:<12} p50 {stats[50]:7.0f} ms   p95 {stats[95]:7.0f} ms   p99 {stats[99]:7.0f} ms"
+                )
+        with self._lock:
+            failures = [f"{outcome}: {count}" for outcome, count in self.outcomes.items()
+                        if outcome not in self.NOT_ERRORS]
+        if failures:
+            lines.append("Errors by type: " + ", ".join(failures))
+        return "\n".join(lines)
+
+    def tray_text(self):
+        """One-line summary for the tray menu"""
+        stats = self.percentiles("hotkey_to_paste")
+        if not stats:
+            return "No corrections yet"
+        return f"p50 {stats[50]:.0f} ms / p95 {stats[95]:.0f} ms / errors {self.error_count()}"
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+
+class CorrectionHistory:
+    """Append-only store of past corrections in SQLite, written by a background thread.
+
+    record() only queues the texts; the writer thread compresses them with
+    zlib and inserts everything queued since its last write in one
+    transaction. The database is in WAL mode, so the history window reads
+    while corrections are written. Corrections older than HISTORY_MAX_AGE_DAYS
+    are deleted, and the oldest ones once the stored texts exceed
+    HISTORY_MAX_BYTES, at startup and every PRUNE_EVERY corrections.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS corrections (id INTEGER PRIMARY KEY, created REAL NOT NULL, model TEXT, "
+        "latency_ms REAL, size INTEGER NOT NULL, original BLOB NOT NULL, corrected BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS corrections_created ON corrections (created)",
+    )
+    COLUMNS = "id, created, model, latency_ms, original, corrected"
+    PRUNE_EVERY = 500
+
+    def __init__(self, path=HISTORY_PATH, max_age_days=HISTORY_MAX_AGE_DAYS, max_bytes=HISTORY_MAX_BYTES):
+        self.path = path
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self.written = 0
+        self._pending = deque()
+        self._closing = False
+        self._changed = threading.Condition()
+        self._reader = None
+        self._read_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="HistoryWriter", daemon=True)
+        self.thread.start()
+
+    def record(self, original, corrected, model=None, latency=None):
+        """Queue a correction for the writer thread; latency in seconds"""
+        with self._changed:
+            if self._closing:
+                return
+            latency_ms = latency * 1000 if latency is not None else None
+            self._pending.append((time.time(), model, latency_ms, original, corrected))
+            self._changed.notify()
+
+    def page(self, before=None, limit=HISTORY_PAGE_SIZE):
+        """Up to limit corrections older than id before, newest first, as rows like get() returns"""
+        before = before if before is not None else 2 ** 63 - 1
+        rows = self._query(f"SELECT {self.COLUMNS} FROM corrections WHERE id < ? ORDER BY id DESC LIMIT ?",
+                           (before, limit))
+        return [self._decode(row) for row in rows]
+
+    def get(self, row_id):
+        """(id, created, model, latency_ms, original, corrected) for one correction, or None"""
+        rows = self._query(f"SELECT {self.COLUMNS} FROM corrections WHERE id = ?", (row_id,))
+        return self._decode(rows[0]) if rows else None
+
+    def close(self, timeout=5.0):
+        """Write what is still queued and stop the writer thread"""
+        with self._changed:
+            self._closing = True
+            self._changed.notify()
+        self.thread.join(timeout)
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    def summary(self):
+        """One line for the stats panel"""
+        return f"History: {self.written} corrections saved this session"
+
+    def _query(self, sql, parameters):
+        with self._read_lock:
+            if self._reader is None and not os.path.exists(self.path):
+                return []  # Nothing written yet
+            try:
+                if self._reader is None:
+                    uri = pathlib.Path(os.path.abspath(self.path)).as_uri() + "?mode=ro"
+                    self._reader = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                return self._reader.execute(sql, parameters).fetchall()
+            except sqlite3.Error as e:
+                print(f"Could not read the correction history: {str(e)}")
+                return []
+
+    def _decode(self, row):
+        return row[:4] + tuple(zlib.decompress(text).decode("utf-8") for text in row[4:])
+
+    def _run(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            # Pages freed by pruning go back to the file system; only takes effect on a new database
+            connection.execute("PRAGMA auto_vacuum=FULL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; a crash loses the last writes
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._prune(connection)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Correction history unavailable: {str(e)}")
+            with self._changed:
+                self._closing = True
+                self._pending.clear()
+            return
+
+        since_prune = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._pending or self._closing)
+                batch = list(self._pending)
+                self._pending.clear()
+                closing = self._closing
+            if batch:
+                rows = []
+                for created, model, latency_ms, original, corrected in batch:
+                    original = zlib.compress(original.encode("utf-8"))
+                    corrected = zlib.compress(corrected.encode("utf-8"))
+                    rows.append((created, model, latency_ms, len(original) + len(corrected), original, corrected))
+                try:
+                    with connection:
+                        connection.executemany(
+                            "INSERT INTO corrections (created, model, latency_ms, size, original, corrected) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", rows
+                        )
+                    self.written += len(rows)
+                    since_prune += len(rows)
+                    if since_prune >= self.PRUNE_EVERY:
+                        self._prune(connection)
+                        since_prune = 0
+                except sqlite3.Error as e:
+                    print(f"Could not save corrections to the history: {str(e)}")
+            if closing:
+                connection.close()
+                return
+
+    def _prune(self, connection):
+        """Delete corrections past the age limit, then the oldest until the texts fit in max_bytes"""
+        with connection:
+            connection.execute("DELETE FROM corrections WHERE created < ?", (time.time() - self.max_age,))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM corrections").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes * 0.9  # Leave room so the next inserts don't prune again
+            cutoff = None
+            for row_id, size in connection.execute("SELECT id, size FROM corrections ORDER BY id"):
+                cutoff = row_id
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.execute("DELETE FROM corrections WHERE id <= ?", (cutoff,))
+
+
+class HistoryWindow:
+    """Lists past corrections newest first and pastes one again without asking the model.
+
+    Older rows are fetched HISTORY_PAGE_SIZE at a time when the list is
+    scrolled near its end, by id rather than offset, so opening and scrolling
+    cost the same with a few corrections or hundreds of thousands.
+    """
+
+    COLUMNS = (("when", "When", 120), ("original", "Original", 230), ("corrected", "Corrected", 230),
+               ("model", "Model", 130))
+    PREVIEW_CHARS = 80
+
+    def __init__(self, root, history, on_paste):
+        self.root = root
+        self.history = history
+        self.on_paste = on_paste  # Called with the text to paste
+        self.window = None
+        self.tree = None
+        self.detail = None
+        self.oldest = None  # id of the last row loaded
+        self.exhausted = False
+        self.loading = False
+
+    def show(self):
+        """Open the window, or bring it to the front with the newest corrections; call on the Tk thread"""
+        if self.window is None:
+            self._build()
+        self.window.deiconify()
+        self.window.lift()
+        self.reload()
+
+    def hide(self):
+        if self.window is not None:
+            self.window.withdraw()
+
+    def reload(self):
+        self.tree.delete(*self.tree.get_children())
+        self.oldest = None
+        self.exhausted = False
+        self._load_page()
+
+    def _build(self):
+        self.window = tk.Toplevel(self.root)
+        self.window.title("Correction history")
+        self.window.geometry("760x520")
+        self.window.protocol("WM_DELETE_WINDOW", self.hide)
+        frame = ttk.Frame(self.window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        names = [name for name, _, _ in self.COLUMNS]
+        self.tree = ttk.Treeview(frame, columns=names, show="headings", selectmode="browse")
+        for name, heading, width in self.COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, stretch=name in ("original", "corrected"))
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=lambda first, last: self._scrolled(scrollbar, first, last))
+        self.tree.bind("<<TreeviewSelect>>", self._selected)
+        self.tree.bind("<Double-1>", lambda event: self._paste("corrected"))
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+
+        self.detail = tk.Text(frame, height=8, wrap=tk.WORD, state=tk.DISABLED)
+        self.detail.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 10))
+
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=2, column=0, columnspan=2)
+        ttk.Button(button_frame, text="Paste Corrected", command=lambda: self._paste("corrected")).grid(
+            row=0, column=0, padx=(0, 10))
+        ttk.Button(button_frame, text="Paste Original", command=lambda: self._paste("original")).grid(
+            row=0, column=1, padx=(0, 10))
+        ttk.Button(button_frame, text="Refresh", command=self.reload).grid(row=0, column=2)
+
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+
+    def _scrolled(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        if float(last) > 0.9 and not self.exhausted:
+            self.window.after_idle(self._load_more)
+
+    def _load_more(self):
+        """Load the next page if the end of the list is (still) in view"""
+        if self.tree.yview()[1] > 0.9:
+            self._load_page()
+
+    def _load_page(self):
+        if self.exhausted or self.loading:
+            return
+        self.loading = True
+        try:
+            rows = self.history.page(before=self.oldest)
+            for row_id, created, model, _, original, corrected in rows:
+                when = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+                values = (when, self._preview(original), self._preview(corrected), model or "")
+                self.tree.insert("", tk.END, iid=str(row_id), values=values)
+            if rows:
+                self.oldest = rows[-1][0]
+            self.exhausted = len(rows) < HISTORY_PAGE_SIZE
+        finally:
+            self.loading = False
+
+    def _preview(self, text):
+        text = " ".join(text.split())
+        return text if len(text) <= self.PREVIEW_CHARS else text[:self.PREVIEW_CHARS - 3] + "..."
+
+    def _selected_row(self):
+        selection = self.tree.selection()
+        return self.history.get(int(selection[0])) if selection else None
+
+    def _selected(self, event=None):
+        row = self._selected_row()
+        if row is None:
+            return
+        _, _, model, latency_ms, original, corrected = row
+        timing = f" in {latency_ms:.0f} ms" if latency_ms is not None else ""
+        self.detail.config(state=tk.NORMAL)
+        self.detail.delete("1.0", tk.END)
+        self.detail.insert(tk.END, f"Original:\n{original}\n\nCorrected ({model or 'unknown model'}{timing}):\n{corrected}")
+        self.detail.config(state=tk.DISABLED)
+
+    def _paste(self, column):
+        row = self._selected_row()
+        if row is None:
+            return
+        self.hide()  # Give the focus back to the window the text goes into
+        self.on_paste(row[4] if column == "original" else row[5])
+
+
+class SpeculativeCorrector:
+    """Starts correcting copied text before F9 is pressed, so F9 on the same text finds the answer ready.
+
+    A thread polls the clipboard; new text is corrected as a low-priority task
+    on the correction engine's loop, through the correction cache, where F9
+    either finds the result or joins the request still in flight. Only prose
+    between SPECULATIVE_MIN_CHARS and SPECULATIVE_MAX_CHARS, copied outside
+    SPECULATIVE_DENYLIST apps, is sent, and only while no hotkey correction
+    is running and the rate limiter has SPECULATIVE_MIN_AVAILABLE requests to
+    spare. A newer copy or an F9 on other text cancels the pending one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.text = None  # Latest text being (or already) pre-corrected
+        self.task = None
+        self.claimed = False  # F9 asked for self.text, so it must not be cancelled
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.skipped = 0
+        self._ignored = deque(maxlen=8)  # Text the app itself put on the clipboard
+
+    def run(self):
+        """Poll the clipboard until the app shuts down"""
+        last_sequence = None
+        last_text = None
+        while not self.app.shutting_down.wait(SPECULATIVE_POLL):
+            sequence = self.app.clipboard.sequence_number()
+            if sequence is not None and sequence == last_sequence:
+                continue  # Cheap check where the OS counts clipboard changes
+            last_sequence = sequence
+            try:
+                text = self.app.clipboard.paste()
+            except Exception:
+                continue
+            if not text or text == last_text:
+                continue
+            last_text = text
+            loop = self.app.engine.loop
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(self.consider, text, self.app.keys.foreground_app())
+
+    def ignore(self, *texts):
+        """Don't pre-correct these when they show up on the clipboard (our own pastes and restores)"""
+        self._ignored.extend(texts)
+
+    def claim(self, text):
+        """A hotkey correction of text is starting; safe to call from any thread"""
+        loop = self.app.engine.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._claim, text)
+
+    def _claim(self, text):
+        if text == self.text:
+            if not self.claimed:
+                self.claimed = True
+                self.used += 1
+        else:
+            self.cancel()  # F9 goes first
+
+    def cancel(self):
+        if self.task is not None and not self.task.done() and not self.claimed:
+            self.task.cancel()
+            self.cancelled += 1
+
+    def skip_reason(self, text, app):
+        """Why text should not be pre-corrected, or None"""
+        if text in self._ignored:
+            return "pasted by the app"
+        if not SPECULATIVE_MIN_CHARS <= len(text.strip()) <= SPECULATIVE_MAX_CHARS:
+            return f"{len(text.strip())} characters"
+        if any(name in app.lower() for name in SPECULATIVE_DENYLIST):
+            return f"copied in {app}"
+        if not looks_like_prose(text):
+            return "not prose"
+        if not self.app.backend_ready.is_set() or self.app.use_local_backend(text):
+            return "no remote backend"
+        if self.app.engine.busy():
+            return "a hotkey correction is running"
+        if self.app.limiter.available() < SPECULATIVE_MIN_AVAILABLE:
+            return "saving requests for F9"
+        return None
+
+    def consider(self, text, app):
+        """Pre-correct newly copied text unless it should be skipped; runs on the engine loop"""
+        if text == self.text:
+            return
+        self.cancel()
+        self.text = text
+        self.claimed = False
+        self.task = None
+        reason = self.skip_reason(text, app)
+        if reason:
+            self.skipped += 1
+            print(f"Not pre-correcting copied text: {reason}")
+            return
+        self.started += 1
+        self.task = asyncio.get_running_loop().create_task(self.correct(text))
+
+    async def correct(self, text):
+        try:
+            await self.app.apply_remote_corrections_async(text)
+        except Exception as e:
+            print(f"Pre-correction failed: {str(e)}")
+
+    def summary(self):
+        """One line for the stats panel"""
+        return (f"Pre-correction: {self.started} started, {self.used} used by {KEYBOARD_HOTKEY}, "
+                f"{self.cancelled} cancelled, {self.skipped} skipped")
+
+
+class CorrectionServer:
+    """Local HTTP API for editors and scripts, answered by the app's own client, cache and rate limiter.
+
+    Listens on host:port, or on a Unix socket when socket_path is set.
+    Corrections run on the correction engine's event loop, like hotkey presses:
+
+        POST /v1/correct        {"text": "..."}          -> {"corrected_text": "..."}
+        POST /v1/correct-batch  {"texts": ["...", ...]}  -> {"corrected_texts": [...], "errors": [...]}
+        GET  /v1/stats                                   -> counters and the stats panel text
+    """
+
+    def __init__(self, app, host=SERVER_HOST, port=SERVER_PORT, socket_path=SERVER_SOCKET, token=SERVER_TOKEN):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.token = token
+        self.requests = 0
+        self.corrected = 0
+        self.errors = 0
+        self.httpd = None
+        self.thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        if self.socket_path:
+            return f"unix:{self.socket_path}"
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving in a background thread"""
+        handler = self._make_handler()
+        if self.socket_path:
+            if not hasattr(socketserver, "UnixStreamServer"):
+                raise RuntimeError("Unix sockets are not supported on this system")
+            try:
+                os.unlink(self.socket_path)  # Left behind by a previous run
+            except FileNotFoundError:
+                pass
+
+            class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+                daemon_threads = True
+
+            self.httpd = UnixHTTPServer(self.socket_path, handler)
+            os.chmod(self.socket_path, 0o600)
+        else:
+            self.httpd = http_server.ThreadingHTTPServer((self.host, self.port), handler)
+            self.httpd.daemon_threads = True
+        self.app.engine.start()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="CorrectionServer", daemon=True)
+        self.thread.start()
+        print(f"Correction API listening on {self.address}")
+        return self
+
+    def stop(self):
+        """Stop serving and release the port or socket"""
+        if self.httpd is None:
+            return
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        self.httpd = None
+
+    def count(self, corrected=0, errors=0):
+        with self._lock:
+            self.requests += 1
+            self.corrected += corrected
+            self.errors += errors
+
+    def run(self, coroutine):
+        """Run a coroutine on the correction engine's loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.app.engine.loop)
+        try:
+            return future.result(SERVER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def correct(self, text):
+        if not text.strip():
+            return text
+        return await self.app.apply_corrections_async(text)
+
+    async def correct_batch(self, texts):
+        # Bounded like batch mode so a large batch doesn't run into the rate limiter's deadline all at once
+        slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def correct(text):
+            async with slots:
+                return await self.correct(text)
+
+        return await asyncio.gather(*(correct(text) for text in texts), return_exceptions=True)
+
+    @staticmethod
+    def status_for(error):
+        """HTTP status for a failed correction"""
+        if isinstance(error, RateLimitExceeded):
+            return 429
+        if isinstance(error, BackendUnavailable):
+            return 503
+        if isinstance(error, (concurrent.futures.TimeoutError, asyncio.TimeoutError, TimeoutError)):
+            return 504
+        return 502
+
+    def handle_correct(self, body):
+        text = body.get("text")
+        if not isinstance(text, str):
+            return 400, {"error": 'Expected {"text": "..."}'}
+        try:
+            corrected = self.run(self.correct(text))
+        except Exception as e:
+            self.count(errors=1)
+            return self.status_for(e), {"error": str(e) or type(e).__name__}
+        self.count(corrected=1)
+        return 200, {"corrected_text": corrected}
 
+    def handle_correct_batch(self, body):
+        texts = body.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {"error": 'Expected {"texts": ["...", ...]}'}
+        if len(texts) > SERVER_MAX_BATCH:
+            return 413, {"error": f"At most {SERVER_MAX_BATCH} texts per request"}
+        try:
+            results = self.run(self.correct_batch(texts))
+        except Exception as e:
+            self.count(errors=len(texts))
+            return self.status_for(e), {"error": str(e) or type(e).__name__}
+        errors = [{"index": index, "error": str(result) or type(result).__name__, "status": self.status_for(result)}
+                  for index, result in enumerate(results) if isinstance(result, Exception)]
+        self.count(corrected=len(texts) - len(errors), errors=len(errors))
+        corrected = [None if isinstance(result, Exception) else result for result in results]
+        return 200, {"corrected_texts": corrected, "errors": errors}
 
-# Application constants
-SERVICE_NAME = "SimpleStupidGrammar"
-CREDENTIAL_NAME = "GoogleAPIKey"
+    def stats(self):
+        """Counters for GET /v1/stats"""
+        app = self.app
+        connections = app.connections
+        with self._lock:
+            api = {"requests": self.requests, "corrected": self.corrected, "errors": self.errors}
+        return {
+            "ready": app.backend_ready.is_set(),
+            "backend": getattr(app.backend, "name", None),
+            "corrections": app.latency.correction_count(),
+            "errors": app.latency.error_count(),
+            "cache": {"hits": app.cache.hits, "misses": app.cache.misses},
+            "connections": {"requests": connections.requests, "cold": connections.cold,
+                            "warmups": connections.warmups, "http2": connections.http2},
+            "api": api,
+            "summary": app.stats_text(),
+        }
 
-# Try different hotkey combinations if ctrl+alt+0 doesn't work:
-# KEYBOARD_HOTKEY = "ctrl+shift+g"  # Alternative 1
-# KEYBOARD_HOTKEY = "ctrl+alt+g"    # Alternative 2
-KEYBOARD_HOTKEY = "f9"  # Alternative 3
-# KEYBOARD_HOTKEY = "ctrl+alt+0"
+    def summary(self):
+        """One line for the stats panel"""
+        with self._lock:
+            return f"API ({self.address}): {self.corrected} corrected, {self.errors} errors"
 
-MODEL = "models/gemini-2.0-flash-lite"
-PROMPT = "Make the following text grammatically correct: "
+    def _make_handler(self):
+        server = self
+        routes = {"/v1/correct": self.handle_correct, "/v1/correct-batch": self.handle_correct_batch}
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass  # Unix socket clients have no address to log, and the stats count requests
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/v1/stats":
+                    self.discard_body()
+                    return self.send_json(404, {"error": "Unknown endpoint"})
+                if self.authorized():
+                    self.send_json(200, server.stats())
+
+            def do_POST(self):
+                route = routes.get(self.path.split("?", 1)[0])
+                if route is None:
+                    self.discard_body()
+                    return self.send_json(404, {"error": "Unknown endpoint"})
+                if not self.authorized():
+                    return
+                body = self.read_json()
+                if body is not None:
+                    self.send_json(*route(body))
+
+            def authorized(self):
+                # Browsers send Origin with cross-site requests; web pages must not be able to use the API
+                if self.headers.get("Origin"):
+                    self.discard_body()
+                    self.send_json(403, {"error": "Cross-origin requests are not allowed"})
+                    return False
+                if server.token and self.headers.get("Authorization") != f"Bearer {server.token}":
+                    self.discard_body()
+                    self.send_json(401, {"error": "Missing or wrong token"})
+                    return False
+                return True
+
+            def body_length(self):
+                try:
+                    return int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    return -1
+
+            def discard_body(self):
+                # Left unread, the body would be parsed as the next request on a keep-alive connection
+                length = self.body_length()
+                if 0 <= length <= SERVER_MAX_BODY:
+                    self.rfile.read(length)
+                else:
+                    self.close_connection = True
+
+            def read_json(self):
+                length = self.body_length()
+                if length < 0 or length > SERVER_MAX_BODY:
+                    self.close_connection = True  # The body is not read
+                    self.send_json(413, {"error": f"Body must be at most {SERVER_MAX_BODY} bytes"})
+                    return None
+                try:
+                    body = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+                except ValueError:
+                    body = None
+                if not isinstance(body, dict):
+                    self.send_json(400, {"error": "Body must be a JSON object"})
+                    return None
+                return body
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
 
 
 class SimpleStupidGrammar:
-    def __init__(self):
+    def __init__(self, backend=None, clipboard=None, keys=None, headless=False):
+        # backend, clipboard and keys replace the real ones (benchmarks, tests);
+        # headless skips the window and the tray icon
         try:
             print("Starting app initialization...")
-            # Get Google API key before initializing the client
-            api_key = self.get_google_api_key()
-            print(f"Got API key: {'Yes' if api_key else 'No'}")
-            if not api_key:
-                print("ERROR: No Google API key provided!")
-                sys.exit(1)
-            
-            # Initialize the client with the API key
-            global client
-            client = genai.Client(api_key=api_key)
-            print("Client initialized successfully")
+            self.local_backend = LocalRuleBackend()
+            self.clipboard = clipboard or (SystemClipboard() if headless else system_clipboard())
+            self.keys = keys or (SystemKeys() if headless else system_keys())
+            self.restorer = ClipboardRestorer(self.clipboard)
+            self.history = CorrectionHistory() if HISTORY and not headless else None
+            self.history_window = None
+            self.headless = headless
+            self.last_trace = None
+            self.backend = backend
+            self.backend_ready = threading.Event()
+            if backend is None and BACKEND == "local":
+                # Offline mode: no API key or client needed
+                self.backend = self.local_backend
+            if self.backend is not None:
+                self.backend_ready.set()
+
+            self.cache = CorrectionCache()
+            self.latency = LatencyRecorder()
+            self.connections = ConnectionStats()
+            self.limiter = TokenBucket()
+            self.breaker = CircuitBreaker()
+            self.shutting_down = threading.Event()
+            self.copy_latency = CopyLatencyTracker()
+            self.engine = CorrectionEngine(self)
             
-            self.root = tk.Tk()
-            self.setup_ui()
             self.is_running = False
-            self.hotkey_thread = None
+            self.hotkey = HotkeySupervisor(
+                KEYBOARD_HOTKEY, self.engine.submit, prepare=self.engine.start, on_error=self.notify_hotkey_error
+            )
+            self.warmer_thread = None
+            self.tray_thread = None
+            self.server = None
+            self.speculator = SpeculativeCorrector(self) if SPECULATIVE else None
+            self.speculator_thread = None
+            self.thread_restarts = Counter()
             self.tray_icon = None
+            self.root = None
+            self.preview = None
+            if headless:
+                if not self.backend_ready.is_set():
+                    self.init_backend(GEMINI_API_KEY or self.get_stored_api_key())
+                return
+
+            self.root = tk.Tk()
+            self.preview = PreviewOverlay(self.root) if STREAM_PREVIEW else None
+            self.setup_ui()
             self.hidden = False  # Start visible by default
             
             # Keep the window visible on startup
             # self.root.withdraw()  # Removed - keep window visible
             
-            # Create system tray icon
-            self.setup_tray()
-            
-            # Auto-start monitoring
-            self.root.after(100, self.start_monitoring)
+            # Register the hotkey straight away. The API key lookup (which can take
+            # seconds on some keyring backends), the client and the tray icon are
+            # set up in the background; presses before then wait for the backend.
+            self.start_monitoring()
+            if SERVER_ENABLED:
+                self.start_server()
+            if self.speculator:
+                self.start_speculator()
+            threading.Thread(target=self.finish_startup, name="Startup", daemon=True).start()
+            self.root.after_idle(self.set_window_icon)
+            if INPUT_PROBE and isinstance(self.keys, SystemKeys) and self.keys.method is None:
+                self.root.after(500, self.probe_input)  # Once the window is mapped
+            self.root.after(STATS_REFRESH_MS, self.refresh_stats)
             
         except Exception as e:
             print(f"ERROR: Failed to initialize application: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            if not headless:  # Headless callers report the error themselves
+                import traceback
+                traceback.print_exc()
             raise
 
-    def get_google_api_key(self):
-        """Get Google API key from stored credentials or user input"""
-        print("get_google_api_key called")
+    def finish_startup(self):
+        """Slow startup work kept off the critical path: tray icon, API key lookup and client"""
+        try:
+            # Create system tray icon
+            self.setup_tray()
+        except Exception as e:
+            print(f"Failed to create tray icon: {str(e)}")
+
+        if self.backend_ready.is_set():
+            return
+        api_key = GEMINI_API_KEY or self.get_stored_api_key()
+        if api_key:
+            self.init_backend(api_key)
+        else:
+            # Prompting needs the Tk main thread
+            self.root.after(0, self.prompt_and_init_backend)
+
+    def prompt_and_init_backend(self):
+        """Ask for the API key on the Tk thread, then build the client in the background"""
+        api_key = self.prompt_for_api_key()
+        if not api_key:
+            print("ERROR: No Google API key provided!")
+            self.quit_app()
+            return
+        threading.Thread(target=self.init_backend, args=(api_key,), name="Startup", daemon=True).start()
+
+    def init_backend(self, api_key):
+        """Create the Gemini backend and let waiting corrections through"""
+        print(f"Got API key: {'Yes' if api_key else 'No'}")
+        if not api_key:
+            raise MissingApiKeyError("No Google API key provided")
+        # Initialize the client with the API key
+        client = make_gemini_client(api_key, self.connections)
+        routes = [(GeminiBackend(client, model=model), max_tokens) for model, max_tokens in MODELS]
+        if HEDGE_MODEL and HEDGE_MODEL not in dict(MODELS):
+            routes.append((GeminiBackend(client, model=HEDGE_MODEL), 0))  # Only used for hedges
+        self.backend = ResilientBackend(AdaptiveBackend(routes, limiter=self.limiter), self.limiter, self.breaker)
+        self.backend_ready.set()
+        print(f"Client initialized successfully ({(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start)")
+        if WARMUP:
+            self.warmer_thread = threading.Thread(target=self.keep_connections_warm, name="ConnectionWarmer", daemon=True)
+            self.warmer_thread.start()
+
+    def keep_connections_warm(self):
+        """Warm the connection pools now, then again whenever they have sat idle for a while"""
+        self.warm_connections()
+        interval = max(1.0, WARMUP_IDLE_SECONDS / 4) if WARMUP_IDLE_SECONDS else None
+        while interval and not self.shutting_down.wait(interval):
+            if self.connections.should_rewarm():
+                self.warm_connections()
+
+    def warm_connections(self):
+        """Send a cheap request through the client on the engine's event loop, which corrections use"""
+        started = time.perf_counter()
+        try:
+            self.engine.start()
+            asyncio.run_coroutine_threadsafe(self.backend.warm_up_async(), self.engine.loop).result(GEMINI_TIMEOUT)
+        except Exception as e:
+            print(f"Connection warm-up failed: {str(e)}")
+            return
+        print(f"Connections warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def wait_for_backend(self):
+        """Block until the backend exists; it is created in the background at startup"""
+        if not self.backend_ready.wait(GEMINI_TIMEOUT):
+            raise RuntimeError("Grammar service is still starting up")
+
+    def get_stored_api_key(self):
+        """Get the Google API key from stored credentials, or None"""
         try:
-            # First, try to get from stored credentials
             print("Checking stored credentials...")
-            stored_key = keyring.get_password(SERVICE_NAME, CREDENTIAL_NAME)
-            if stored_key:
-                print("Found stored key")
-                return stored_key
-            
-            print("No stored key found, prompting user...")
-            # If no stored key, prompt user for the key
-            return self.prompt_for_api_key()
-            
+            return keyring.get_password(SERVICE_NAME, CREDENTIAL_NAME)
         except Exception as e:
             print(f"Error getting API key: {str(e)}")
-            return self.prompt_for_api_key()
+            return None
+
+    def get_google_api_key(self):
+        """Get Google API key from stored credentials or user input"""
+        print("get_google_api_key called")
+        # First, try to get from stored credentials
+        stored_key = self.get_stored_api_key()
+        if stored_key:
+            print("Found stored key")
+            return stored_key
+
+        print("No stored key found, prompting user...")
+        # If no stored key, prompt user for the key
+        return self.prompt_for_api_key()
 
     def prompt_for_api_key(self):
         """Prompt user for Google API key using a dialog"""
@@ -187,6 +3497,8 @@ class SimpleStupidGrammar:
         # Create context menu for tray icon
         menu = pystray.Menu(
             pystray.MenuItem("Show Window", self.show_window),
+            pystray.MenuItem(lambda item: self.latency.tray_text(), self.show_window),
+            pystray.MenuItem("History", self.show_history, visible=self.history is not None),
             pystray.Menu.SEPARATOR,
             pystray.MenuItem("Restart Monitoring", self.restart_monitoring),
             pystray.MenuItem("Reset API Key", self.reset_api_key),
@@ -213,13 +3525,8 @@ class SimpleStupidGrammar:
         self.root.withdraw()
         self.hidden = True
 
-    def setup_ui(self):
-        """Setup the application UI"""
-        self.root.title("Simple Stupid Grammar")
-        self.root.geometry("600x600")
-        self.root.resizable(True, True)
-        
-        # Set window icon (optional)
+    def set_window_icon(self):
+        """Set the window icon once the window is up (needs PIL)"""
         try:
             # Convert PIL image to PhotoImage for tkinter
             icon_image = self.create_tray_icon()
@@ -236,6 +3543,12 @@ class SimpleStupidGrammar:
         except:
             pass  # If icon setting fails, just continue without it
 
+    def setup_ui(self):
+        """Setup the application UI"""
+        self.root.title("Simple Stupid Grammar")
+        self.root.geometry("600x600")
+        self.root.resizable(True, True)
+        
         # Main frame
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -257,6 +3570,12 @@ class SimpleStupidGrammar:
         )
         self.status_label.grid(row=0, column=0)
 
+        self.latency_label = ttk.Label(status_frame, text="Last correction: -")
+        self.latency_label.grid(row=1, column=0, sticky=tk.W)
+
+        self.stats_label = ttk.Label(status_frame, text="", font=("Courier", 9), justify=tk.LEFT)
+        self.stats_label.grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+
         # Control buttons
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=2, column=0, columnspan=2, pady=(0, 20))
@@ -266,6 +3585,11 @@ class SimpleStupidGrammar:
         )
         self.restart_button.grid(row=0, column=0, padx=(0, 10))
 
+        if self.history:
+            self.history_window = HistoryWindow(self.root, self.history, self.repaste)
+            history_button = ttk.Button(button_frame, text="History", command=self.history_window.show)
+            history_button.grid(row=0, column=1, padx=(0, 10))
+
         # Instructions
         instructions_frame = ttk.LabelFrame(
             main_frame, text="Instructions", padding="10"
@@ -300,16 +3624,91 @@ Current hotkey: {KEYBOARD_HOTKEY}"""
         # Bind close event to hide window
         self.root.protocol("WM_DELETE_WINDOW", self.hide_window)
 
+    def stats_text(self):
+        """Text of the stats panel"""
+        lines = [self.latency.summary(), self.connections.summary(), self.restorer.summary()]
+        if self.backend is not None and self.backend.summary():
+            lines.append(self.backend.summary())
+        if isinstance(self.keys, SystemKeys):
+            lines.append(self.keys.summary())
+        if self.history is not None:
+            lines.append(self.history.summary())
+        if self.speculator is not None:
+            lines.append(self.speculator.summary())
+        if self.server is not None:
+            lines.append(self.server.summary())
+        return "\n".join(lines)
+
+    def start_speculator(self):
+        self.speculator_thread = threading.Thread(target=self.speculator.run, name="Speculator", daemon=True)
+        self.speculator_thread.start()
+
+    def supervise_threads(self):
+        """Restart the engine loop, tray icon or speculator if its thread died; runs with the stats refresh"""
+        if self.shutting_down.is_set():
+            return
+        threads = {
+            "correction engine": (self.engine.thread, self.engine.start),
+            "tray icon": (self.tray_thread, self.setup_tray),
+            "clipboard speculator": (self.speculator_thread, self.start_speculator),
+        }
+        for name, (thread, start) in threads.items():
+            if thread is None or thread.is_alive():
+                continue  # Not started (yet), or fine
+            if self.thread_restarts[name] >= THREAD_MAX_RESTARTS:
+                continue
+            self.thread_restarts[name] += 1
+            print(f"The {name} stopped unexpectedly, restarting it ({self.thread_restarts[name]}/{THREAD_MAX_RESTARTS})")
+            try:
+                start()
+            except Exception as e:
+                print(f"Failed to restart the {name}: {str(e)}")
+
+    def refresh_stats(self):
+        """Update the stats panel and tray menu with rolling latency percentiles"""
+        self.supervise_threads()
+        try:
+            self.stats_label.config(text=self.stats_text())
+            if self.tray_icon:
+                self.tray_icon.update_menu()
+        except (tk.TclError, AttributeError):
+            pass
+        self.root.after(STATS_REFRESH_MS, self.refresh_stats)
+
     def quit_app(self, icon=None, item=None):
         """Completely exit the application"""
         if self.is_running:
             self.stop_monitoring()
+        self.shutting_down.set()
+        self.hotkey.close()
+        if self.server:
+            self.server.stop()
+        self.engine.stop()
+        self.restorer.close()
+        if hasattr(self.clipboard, "close"):
+            self.clipboard.close()
+        if self.history:
+            self.history.close()
         if self.tray_icon:
             self.tray_icon.stop()
+        for thread in (self.warmer_thread, self.tray_thread, self.speculator_thread):
+            if thread and thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self.latency.close()
         self.root.quit()
         self.root.destroy()
         sys.exit(0)
 
+    def start_server(self, host=SERVER_HOST, port=SERVER_PORT, socket_path=SERVER_SOCKET):
+        """Serve the local correction API; the app keeps running without it if the port is taken"""
+        try:
+            self.server = CorrectionServer(self, host, port, socket_path).start()
+        except (OSError, RuntimeError) as e:
+            self.server = None
+            print(f"Correction API unavailable: {str(e)}")
+            return False
+        return True
+
     def start_monitoring(self, icon=None, item=None):
         """Start the hotkey monitoring"""
         if self.is_running:
@@ -329,15 +3728,15 @@ Current hotkey: {KEYBOARD_HOTKEY}"""
         except:
             pass
 
-        # Start hotkey monitoring in separate thread
-        self.hotkey_thread = threading.Thread(target=self.monitor_hotkey, daemon=True)
-        self.hotkey_thread.start()
+        # Registered on the supervisor thread
+        self.hotkey.start()
 
     def restart_monitoring(self, icon=None, item=None):
         """Restart the hotkey monitoring"""
         if self.is_running:
             self.stop_monitoring()
         self.start_monitoring()
+        self.hotkey.restart()
 
     def stop_monitoring(self, icon=None, item=None):
         """Stop the hotkey monitoring"""
@@ -358,204 +3757,376 @@ Current hotkey: {KEYBOARD_HOTKEY}"""
         except:
             pass
 
-        # Unhook the hotkey
+        self.hotkey.stop()
+
+    def notify_hotkey_error(self, error):
+        """Tell the user the hotkey could not be registered"""
         try:
-            keyboard.unhook_all_hotkeys()
+            if self.tray_icon:
+                self.tray_icon.notify("Error", f"Hotkey error: {str(error)}. Try running as Administrator!")
         except:
             pass
 
-    def monitor_hotkey(self):
-        """Monitor for the grammar correction hotkey"""
+    def notify_error(self, error):
+        """Show a failed correction in the tray instead of logging it"""
         try:
-            # Register the hotkey
-            keyboard.add_hotkey(KEYBOARD_HOTKEY, self.fix_grammar)
+            if self.tray_icon:
+                self.tray_icon.notify("Error", f"Grammar fix failed: {str(error)}")
+        except:
+            pass
+
+    def capture_selection(self):
+        """Copy the highlighted text; return (highlighted_text, original_clipboard) or None if nothing is selected"""
+        # X11: the highlighted text is the PRIMARY selection, so there is nothing to copy or wait for
+        started = time.perf_counter()
+        highlighted_text = self.keys.read_selection()
+        if highlighted_text and highlighted_text.strip():
+            mark_phase("copy_issued", started)
+            mark_phase("copied")
+            return highlighted_text, None  # The clipboard is saved when pasting
+
+        self.wait_for_hotkey_release()
+
+        # Store current clipboard content to restore later (the user's, if an earlier paste is still on it)
+        current_clipboard, original_clipboard = self.restorer.begin(CURRENT_TRACE.get())
+        original_sequence = self.clipboard.sequence_number()
+        app = self.keys.foreground_app()
 
-            # Keep the thread alive while monitoring
-            while self.is_running:
-                time.sleep(0.1)
+        # Copy highlighted text to clipboard, waiting only as long as the target app needs to fill it
+        mark_phase("copy_issued")
 
+        def arrived(timeout=None):
+            sent_at = time.perf_counter()
+            if not self.wait_for_copy(app, current_clipboard, original_sequence, timeout):
+                return False
+            self.copy_latency.record(app, time.perf_counter() - sent_at)
+            return True
+
+        copied = self.keys.copy_selection(arrived)
+        mark_phase("copied")
+
+        # Get the highlighted text
+        try:
+            highlighted_text = self.clipboard.paste()
         except Exception as e:
-            # Show error notification instead of logging
+            print(f"Could not read the copied selection from the clipboard: {str(e)}")
+            return None
+
+        # Text equal to the old clipboard still counts when the OS saw a new copy (copy, then select and F9)
+        unchanged = highlighted_text == current_clipboard and not (copied and original_sequence is not None)
+        if not highlighted_text or highlighted_text.strip() == "" or unchanged:
+            # Show notification if no text was selected
             try:
                 if self.tray_icon:
-                    self.tray_icon.notify("Error", f"Hotkey error: {str(e)}. Try running as Administrator!")
+                    self.tray_icon.notify("No Text Selected", "Please highlight some text first, then press the hotkey.")
             except:
                 pass
+            return None
 
-    def fix_grammar(self):
-        """Main function to fix grammar of highlighted text"""
-        print("Hotkey received! Starting grammar correction...")
-        time.sleep(1)  # One second delay after hotkey received
-        
+        return highlighted_text, original_clipboard
+
+    def replace_selection(self, highlighted_text, corrected_text, original_clipboard, trace=None):
+        """Paste corrected_text over the selection and restore the clipboard afterwards"""
+        print(f"Original text: {highlighted_text}")
+        print(f"Corrected text: {corrected_text}")
+
+        if original_clipboard is None:
+            # The selection was read without copying; save the clipboard before it is overwritten
+            original_clipboard = self.restorer.begin(trace)[1]
+            self.wait_for_hotkey_release()  # Not waited for before the selection was read
+
+        # Replace the highlighted text
+        self.paste_text(corrected_text, original_clipboard, trace)
+        if self.history:
+            latency = trace.durations().get("hotkey_to_paste") if trace else None
+            self.history.record(highlighted_text, corrected_text, trace.model if trace else None, latency)
+
+        # Show notification
         try:
-            # Store current clipboard content to restore later
-            original_clipboard = ""
-            try:
-                original_clipboard = pyperclip.paste()
-            except:
-                pass
+            if self.tray_icon:
+                self.tray_icon.notify("Grammar Fixed!", "Text has been corrected and replaced.")
+        except:
+            pass
 
-            # Copy highlighted text to clipboard - try multiple methods
-            success = False
-            
-            # Method 1: keyboard library
-            try:
-                if sys.platform == "darwin":  # macOS
-                    keyboard.send('cmd+c')
-                else:  # Windows/Linux
-                    keyboard.send('ctrl+c')
-                time.sleep(0.3)
-                success = True
-            except:
-                pass
-            
-            # Method 2: If keyboard fails, try pyautogui with different approach
-            if not success:
-                try:
-                    if sys.platform == "darwin":  # macOS
-                        pyautogui.hotkey('command', 'c')
-                    else:  # Windows/Linux
-                        pyautogui.hotkey('ctrl', 'c')
-                    time.sleep(0.3)
-                    success = True
-                except:
-                    pass
-            
-            # Method 3: Last resort - use individual key presses with longer delays
-            if not success:
-                try:
-                    if sys.platform == "darwin":  # macOS
-                        pyautogui.keyDown('command')
-                        time.sleep(0.05)
-                        pyautogui.press('c')
-                        time.sleep(0.05)
-                        pyautogui.keyUp('command')
-                    else:  # Windows/Linux
-                        pyautogui.keyDown('ctrl')
-                        time.sleep(0.05)
-                        pyautogui.press('c')
-                        time.sleep(0.05)
-                        pyautogui.keyUp('ctrl')
-                    time.sleep(0.3)
-                except:
-                    pass
+    def paste_text(self, text, original_clipboard=None, trace=None):
+        """Paste text into the focused application and restore the clipboard once the paste is consumed"""
+        if original_clipboard is None:
+            original_clipboard = self.restorer.begin(trace)[1]
+        if self.speculator:
+            self.speculator.ignore(text, original_clipboard)
+        self.clipboard.copy(text)
+        wait_until(lambda: self.clipboard.paste() == text, PASTE_READY_TIMEOUT)
+        self.keys.send_shortcut('v')
+        if trace:
+            trace.mark("pasted")
+        self.restorer.schedule(text, trace)
 
-            # Get the highlighted text
-            try:
-                highlighted_text = pyperclip.paste()
-            except Exception as e:
-                return
+    def repaste(self, text):
+        """Paste a correction from the history into the window that had the focus before ours; no model call"""
+        if not self.hidden:
+            self.hide_window()
+        self.engine.paste(text, delay=HISTORY_REPASTE_DELAY)
 
-            if not highlighted_text or highlighted_text.strip() == "" or highlighted_text == original_clipboard:
-                # Show notification if no text was selected
-                try:
-                    if self.tray_icon:
-                        self.tray_icon.notify("No Text Selected", "Please highlight some text first, then press the hotkey.")
-                except:
-                    pass
-                return
+    def show_history(self, icon=None, item=None):
+        """Open the correction history window"""
+        if self.history_window is not None:
+            self.root.after(0, self.history_window.show)
 
-            # Apply corrections
-            corrected_text = self.apply_corrections(highlighted_text)
+    def probe_input(self):
+        """Find the injection method that reaches the focused window by sending Ctrl+C to a field of our own.
 
-            print(f"Original text: {highlighted_text}")
-            print(f"Corrected text: {corrected_text}")
+        The field takes the key and doesn't copy, so the clipboard is left
+        alone. Skipped when our window doesn't have the focus.
+        """
+        field = ttk.Entry(self.root)
+        field.place(x=0, y=0, width=1, height=1)
+        field.focus_set()
+        self.root.update()
+        if self.root.focus_get() is not field:
+            field.destroy()
+            print("Window is not focused; the input method will be found on the first correction")
+            return
+        arrived = threading.Event()
 
-            # Replace the highlighted text - try multiple methods
-            pyperclip.copy(corrected_text)
-            time.sleep(0.3)  # Ensure clipboard is ready
-            
-            success = False
-            
-            # Method 1: keyboard library
-            try:
-                if sys.platform == "darwin":  # macOS
-                    keyboard.send('cmd+v')
-                else:  # Windows/Linux
-                    keyboard.send('ctrl+v')
-                success = True
-            except:
-                pass
-            
-            # Method 2: If keyboard fails, try pyautogui
-            if not success:
-                try:
-                    if sys.platform == "darwin":  # macOS
-                        pyautogui.hotkey('command', 'v')
-                    else:  # Windows/Linux
-                        pyautogui.hotkey('ctrl', 'v')
-                    success = True
-                except:
-                    pass
-            
-            # Method 3: Last resort
-            if not success:
-                try:
-                    if sys.platform == "darwin":  # macOS
-                        pyautogui.keyDown('command')
-                        time.sleep(0.05)
-                        pyautogui.press('v')
-                        time.sleep(0.05)
-                        pyautogui.keyUp('command')
-                    else:  # Windows/Linux
-                        pyautogui.keyDown('ctrl')
-                        time.sleep(0.05)
-                        pyautogui.press('v')
-                        time.sleep(0.05)
-                        pyautogui.keyUp('ctrl')
-                except:
-                    pass
+        def received(event):
+            arrived.set()
+            return "break"  # Keep the field's own copy binding from running
+        field.bind("<Command-c>" if sys.platform == "darwin" else "<Control-c>", received)
+        threading.Thread(target=self.run_input_probe, args=(field, arrived), name="InputProbe", daemon=True).start()
 
-            # Restore original clipboard after a delay
-            def restore_clipboard():
-                time.sleep(2)
-                try:
-                    pyperclip.copy(original_clipboard)
-                except:
-                    pass
+    def run_input_probe(self, field, arrived):
+        """Send Ctrl+C with each method until the field receives it, within INPUT_REPROBE_TIMEOUT together"""
+        deadline = time.perf_counter() + INPUT_REPROBE_TIMEOUT
+        try:
+            for method in self.keys.METHODS:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                if self.keys.send_shortcut("c", method) and arrived.wait(remaining):
+                    self.keys.confirm(method)
+                    return
+            print("No input method reached our own window; trying them in turn on the first copy")
+        finally:
+            self.root.after(0, field.destroy)
 
-            threading.Thread(target=restore_clipboard, daemon=True).start()
+    def wait_for_hotkey_release(self):
+        """Wait until the hotkey is released so it doesn't mix with the synthesized Ctrl+C"""
+        wait_until(lambda: not self.keys.is_pressed(KEYBOARD_HOTKEY), HOTKEY_RELEASE_TIMEOUT)
 
-            # Show notification
-            try:
-                if self.tray_icon:
-                    self.tray_icon.notify("Grammar Fixed!", "Text has been corrected and replaced.")
-            except:
-                pass
+    def wait_for_copy(self, app, original_clipboard, original_sequence, timeout=None):
+        """Wait for the clipboard to change after sending Ctrl+C; return whether it did.
+
+        timeout shortens the wait learned for app.
+        """
+        if original_sequence is not None:
+            changed = lambda: self.clipboard.sequence_number() != original_sequence
+        else:
+            changed = lambda: self.clipboard.paste() != original_clipboard
+        limit = self.copy_latency.timeout(app)
+        if timeout is not None:
+            limit = min(limit, timeout)
+        return wait_until(
+            changed,
+            limit,
+            initial_delay=min(self.copy_latency.initial_delay(app), limit),
+        )
 
+    async def apply_corrections_async(self, text):
+        """Apply grammar corrections to the text, answering from the cache when possible"""
+        if self.use_local_backend(text):
+            return self.local_backend.correct(text)
+        try:
+            if not self.backend_ready.is_set():
+                await asyncio.get_running_loop().run_in_executor(None, self.wait_for_backend)
+            return await self.apply_remote_corrections_async(text)
         except Exception as e:
-            # Show error notification instead of logging
-            try:
-                if self.tray_icon:
-                    self.tray_icon.notify("Error", f"Grammar fix failed: {str(e)}")
-            except:
-                pass
+            if not self.can_fall_back():
+                raise
+            print(f"{getattr(self.backend, 'name', 'Backend')} failed ({str(e)}), falling back to local rules")
+            return self.local_backend.correct(text)
 
-    def apply_corrections(self, text):
-        """Apply grammar corrections to the text"""
-        corrected = text
-
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=PROMPT + text,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema={
-                    "required": [
-                        "corrected_text",
-                    ],
-                    "properties": {
-                        "corrected_text": {"type": "STRING"},
-                    },
-                    "type": "OBJECT",
-                },
-            ),
-        )
+    def use_local_backend(self, text):
+        """Whether text should be corrected by the local rule engine instead of the configured backend"""
+        if self.backend is self.local_backend:
+            return True
+        return BACKEND == "auto" and len(text.strip()) <= LOCAL_BACKEND_MAX_CHARS
+
+    def can_fall_back(self):
+        """Whether a failed remote correction may be answered by the local rule engine"""
+        return BACKEND == "auto" and LOCAL_FALLBACK and self.backend is not self.local_backend
+
+    async def apply_remote_corrections_async(self, text):
+        """Correct text with the configured backend through the cache, chunking large selections"""
+        key = self.cache_key(text)
+        with self.collect_answers():
+            if estimate_tokens(text) > CHUNK_THRESHOLD_TOKENS:
+                return await self.cache.get_or_compute_async(
+                    key, lambda: self.correct_in_chunks_async(text), self.primary_answered
+                )
+            return await self.cache.get_or_compute_async(
+                key, lambda: self.correct_text_async(text), self.primary_answered
+            )
+
+    @staticmethod
+    @contextlib.contextmanager
+    def collect_answers():
+        """Collect the models answering inside the block in ANSWERED_BY, adding them to any enclosing block's"""
+        outer = ANSWERED_BY.get()
+        models = set()
+        token = ANSWERED_BY.set(models)
+        try:
+            yield models
+        finally:
+            ANSWERED_BY.reset(token)
+            if outer is not None:
+                outer.update(models)
+
+    def primary_answered(self):
+        """Whether only the configured model answered so far, so the result may be cached under its key.
 
-        corrected = json.loads(response.text)["corrected_text"]
+        An AdaptiveBackend can route a request, or hand it to a hedge, on a
+        different model; those answers are used but not cached as the
+        configured model's.
+        """
+        models = ANSWERED_BY.get()
+        return not models or models <= {self.backend.model}
 
+    async def correct_text_async(self, text):
+        """Correct text that missed the cache, re-using corrections of unchanged sentences"""
+        plan = self.plan_incremental(text)
+        if plan is not None:
+            corrections = await self.request_sentence_corrections_async(plan["missing_sentences"])
+            corrected = self.finish_incremental(plan, corrections)
+            if corrected is not None:
+                return corrected
+        corrected = await self.request_correction_async(text)
+        self.remember_sentences(text, corrected)
         return corrected
 
+    def cache_key(self, text, sentences=False):
+        """Cache key of text corrected by the configured backend, with the prompt and output format it sends"""
+        return self.cache.make_key(text, model=self.backend.model, prompt=self.backend.cache_prompt(sentences))
+
+    def sentence_key(self, sentence):
+        """Cache key of a single corrected sentence"""
+        return self.cache_key(sentence.strip(), sentences=True)
+
+    def plan_incremental(self, text):
+        """Work out which sentences of text still need correcting.
+
+        Returns None when there is nothing to re-use (single sentence or no
+        sentence seen before), in which case the whole text is sent.
+        """
+        if not SENTENCE_CACHE:
+            return None
+        pieces = SENTENCE_BREAK.split(text)
+        if len(pieces) < 3:
+            return None
+        cached = {}
+        missing = []
+        for index in range(0, len(pieces), 2):
+            if not pieces[index].strip():
+                continue
+            corrected = self.cache.get(self.sentence_key(pieces[index]))
+            if corrected is None:
+                missing.append(index)
+            else:
+                cached[index] = corrected
+        if not cached:
+            return None
+        print(f"Re-using {len(cached)} corrected sentences, sending {len(missing)}")
+        return {
+            "pieces": pieces,
+            "cached": cached,
+            "missing": missing,
+            "missing_sentences": [pieces[index].strip() for index in missing],
+        }
+
+    def finish_incremental(self, plan, corrections):
+        """Stitch cached and freshly corrected sentences back together, or None if the model answer doesn't line up"""
+        if corrections is None or len(corrections) != len(plan["missing"]):
+            return None
+        pieces = list(plan["pieces"])
+        for index, corrected in plan["cached"].items():
+            pieces[index] = preserve_layout(pieces[index], corrected)
+        keep = self.primary_answered()
+        for index, corrected in zip(plan["missing"], corrections):
+            if keep:
+                self.cache.put(self.sentence_key(pieces[index]), corrected.strip())
+            pieces[index] = preserve_layout(pieces[index], corrected)
+        return "".join(pieces)
+
+    def remember_sentences(self, text, corrected):
+        """Cache each sentence of a whole-text correction when the sentences line up one to one"""
+        if not SENTENCE_CACHE or not self.primary_answered():
+            return
+        originals = SENTENCE_BREAK.split(text)[::2]
+        corrections = SENTENCE_BREAK.split(corrected.strip())[::2]
+        if len(originals) < 2 or len(originals) != len(corrections):
+            return
+        for original, correction in zip(originals, corrections):
+            if original.strip():
+                self.cache.put(self.sentence_key(original), correction.strip())
+
+    async def correct_in_chunks_async(self, text):
+        """Correct a large selection as independent chunks, CHUNK_WORKERS at a time, and reassemble it in order"""
+        pieces = split_into_chunks(text)
+        print(f"Correcting large selection in {(len(pieces) + 1) // 2} chunks")
+        workers = asyncio.Semaphore(CHUNK_WORKERS)
+
+        async def correct(piece):
+            async with workers:
+                return await self.correct_chunk_async(piece)
+
+        corrected = await asyncio.gather(*[
+            correct(piece) if index % 2 == 0 and piece.strip() else asyncio.sleep(0, piece)
+            for index, piece in enumerate(pieces)
+        ])
+        return "".join(corrected)
+
+    async def correct_chunk_async(self, chunk):
+        """Correct one chunk of a large selection, keeping its surrounding whitespace and line endings"""
+        core = chunk.strip()
+        with self.collect_answers():
+            corrected = await self.cache.get_or_compute_async(
+                self.cache_key(core), lambda: self.correct_text_async(core), self.primary_answered
+            )
+        return preserve_layout(chunk, corrected)
+
+    async def request_sentence_corrections_async(self, sentences):
+        """Ask the backend to correct a list of sentences; return the corrected list"""
+        return await self.backend.correct_sentences_async(sentences)
+
+    async def request_correction_async(self, text):
+        """Ask the backend to correct the text, previewing streamed output as it arrives"""
+        try:
+            return await self.backend.correct_async(
+                text, on_partial=self.show_partial, on_latency=self.report_latency
+            )
+        finally:
+            if self.preview:
+                self.preview.hide()
+
+    def show_partial(self, partial_text):
+        """Update the preview overlay with the text corrected so far"""
+        if partial_text and self.preview:
+            self.preview.show(partial_text)
+
+    def report_latency(self, stream):
+        """Report time-to-first-token next to the total model latency"""
+        mark_phase("request_sent", stream.started, first=True)
+        mark_phase("first_byte", stream.first_token_at, first=True)
+        ttft = stream.time_to_first_token
+        ttft_text = f"{ttft * 1000:.0f} ms" if ttft is not None else "-"
+        message = f"Last correction: first token {ttft_text}, total {stream.total_time * 1000:.0f} ms"
+        print(message)
+        if self.root is None:
+            return
+        try:
+            self.root.after(0, self.latency_label.config, {"text": message})
+        except (tk.TclError, RuntimeError):
+            pass
+
     def run(self):
         """Start the application"""        
         # Show initial notification
@@ -568,7 +4139,324 @@ Current hotkey: {KEYBOARD_HOTKEY}"""
         self.root.mainloop()
 
 
-if __name__ == "__main__":
+def split_blocks(text):
+    """Split a document into (correct, text) pieces: paragraphs to correct and lines copied as they are.
+
+    Blank lines and fenced code blocks (``` or ~~~) are kept; every other run
+    of consecutive lines is one paragraph.
+    """
+    blocks = []
+    paragraph = []
+    in_fence = False
+
+    def flush():
+        if paragraph:
+            blocks.append((True, "".join(paragraph)))
+            paragraph.clear()
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith(("```", "~~~")):
+            flush()
+            in_fence = not in_fence
+            blocks.append((False, line))
+        elif in_fence or not stripped:
+            flush()
+            blocks.append((False, line))
+        else:
+            paragraph.append(line)
+    flush()
+    return blocks
+
+
+def find_documents(paths, extensions=BATCH_EXTENSIONS):
+    """Expand files, directories and "-" (stdin) into [(path, name)], name being the path to write under"""
+    documents = []
+    for path in paths:
+        if path == "-":
+            documents.append(("-", "-"))
+        elif os.path.isdir(path):
+            root = os.path.basename(os.path.normpath(path))
+            for folder, folders, files in os.walk(path):
+                folders[:] = sorted(name for name in folders if not name.startswith("."))
+                for name in sorted(files):
+                    if name.lower().endswith(tuple(extensions)):
+                        full = os.path.join(folder, name)
+                        documents.append((full, os.path.join(root, os.path.relpath(full, path))))
+        elif os.path.isfile(path):
+            documents.append((path, os.path.basename(path)))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+    return documents
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class BatchCorrector:
+    """Corrects documents with the app's correction pipeline, paragraph by paragraph, keeping every line in place.
+
+    Paragraphs from all documents are corrected concurrently, up to
+    concurrency at a time. A paragraph whose correction doesn't have the same
+    number of lines is corrected again line by line, so line N of the output
+    is always the corrected line N of the input.
+    """
+
+    def __init__(self, app, concurrency=BATCH_CONCURRENCY, show_progress=True, stream=None):
+        self.app = app
+        self.concurrency = concurrency
+        self.show_progress = show_progress
+        self.stream = stream or sys.stderr
+        self.paragraphs = 0
+        self.paragraphs_done = 0
+        self.failed = 0
+        self.documents = 0
+        self.documents_done = 0
+        self._slots = None
+        self._last_report = 0.0
+
+    async def correct_document(self, text):
+        """Return the corrected text of a whole document"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        blocks = split_blocks(text)
+        self.paragraphs += sum(1 for correct, _ in blocks if correct)
+
+        async def keep(block):
+            return block
+
+        corrected = await asyncio.gather(*(
+            self.correct_paragraph(block) if correct else keep(block) for correct, block in blocks
+        ))
+        return "".join(corrected)
+
+    async def correct_paragraph(self, paragraph):
+        lines = paragraph.splitlines(keepends=True)
+        content = [line.rstrip("\r\n") for line in lines]
+        endings = [line[len(text):] for line, text in zip(lines, content)]
+        try:
+            async with self._slots:
+                corrected = await self.app.apply_corrections_async("\n".join(content))
+            corrected_lines = corrected.replace("\r\n", "\n").strip().split("\n")
+            if len(corrected_lines) != len(content):
+                # The model reflowed the paragraph; correct it line by line so line numbers still match
+                corrected_lines = await asyncio.gather(*(self.correct_line(line) for line in content))
+        except Exception as e:
+            self.failed += 1
+            print(f"Keeping a paragraph unchanged: {str(e)}")
+            return paragraph
+        finally:
+            self.paragraphs_done += 1
+            self.report()
+        return "".join(
+            preserve_layout(original, new.replace("\n", " ")) + ending
+            for original, new, ending in zip(content, corrected_lines, endings)
+        )
+
+    async def correct_line(self, line):
+        if not line.strip():
+            return line
+        async with self._slots:
+            return await self.app.apply_corrections_async(line)
+
+    def report(self, final=False):
+        """Show progress on stderr, at most a few times a second"""
+        if not self.show_progress:
+            return
+        now = time.perf_counter()
+        if not final and now - self._last_report < 0.2:
+            return
+        self._last_report = now
+        line = (f"[{self.paragraphs_done}/{self.paragraphs} paragraphs] "
+                f"{self.documents_done}/{self.documents} files done")
+        if self.failed:
+            line += f", {self.failed} paragraphs failed"
+        if self.stream.isatty():
+            self.stream.write("\r" + line + ("\n" if final else ""))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    """Write the manifest atomically, so an interruption never leaves it half-written"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def write_text(path, text):
+    """Write text through a temporary file so a partial file never replaces a complete one"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".ssg-tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+async def correct_documents(app, documents, output_for, manifest_path, args, stdout):
+    """Correct every document, skipping those the manifest marks as done; return the BatchCorrector"""
+    corrector = BatchCorrector(app, args.concurrency, show_progress=not args.no_progress)
+    manifest = {} if args.restart or not manifest_path else load_manifest(manifest_path)
+    pending = []
+    for path, name in documents:
+        output = output_for(path, name)
+        entry = manifest.get(name)
+        if (entry and output and os.path.exists(output) and path != "-"
+                and file_digest(path) in (entry["input"], entry["output"])):
+            continue
+        pending.append((path, name, output))
+    skipped = len(documents) - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} files were already corrected", file=sys.stderr)
+    corrector.documents = len(pending)
+    files = asyncio.Semaphore(max(1, args.concurrency * 4))  # Bounds how many documents are held in memory
+
+    async def correct(path, name, output):
+        async with files:
+            if path == "-":
+                text = sys.stdin.read()
+            else:
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    text = f.read()
+            corrected = await corrector.correct_document(text)
+            if output is None:
+                stdout.write(corrected)
+                stdout.flush()
+            else:
+                write_text(output, corrected)
+            corrector.documents_done += 1
+            if manifest_path and path != "-":
+                manifest[name] = {
+                    "input": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                    "output": hashlib.sha256(corrected.encode("utf-8")).hexdigest(),
+                }
+                save_manifest(manifest_path, manifest)
+
+    await asyncio.gather(*(correct(*document) for document in pending))
+    corrector.report(final=True)
+    return corrector
+
+
+def run_batch(argv):
+    """Headless batch mode: correct files, directories or stdin without Tk, the tray or keyboard hooks"""
+    import argparse
+
+    global BACKEND
+    parser = argparse.ArgumentParser(
+        prog="simple-stupid-grammar",
+        description="Correct the grammar of text files, directories or stdin (-) without the GUI. "
+                    "Run without arguments to start the tray app.",
+    )
+    parser.add_argument("paths", nargs="+", help="Files, directories (searched for --extensions) or - for stdin")
+    parser.add_argument("-o", "--output-dir", help="Write corrected files here, mirroring the input names")
+    parser.add_argument("--in-place", action="store_true", help="Overwrite the input files")
+    parser.add_argument("-j", "--concurrency", type=int, default=BATCH_CONCURRENCY, help="Paragraphs corrected at once")
+    parser.add_argument("--extensions", nargs="+", default=list(BATCH_EXTENSIONS), help="File types searched in directories")
+    parser.add_argument("--manifest", help=f"Progress file for resuming (default: {BATCH_MANIFEST} in the output "
+                                           "directory, or in the current directory with --in-place)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the manifest and correct everything again")
+    parser.add_argument("--backend", choices=("auto", "gemini", "local"), default=BACKEND)
+    parser.add_argument("--no-progress", action="store_true", help="Don't show progress on stderr")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the app's log on stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        documents = find_documents(args.paths, args.extensions)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if not documents:
+        parser.error("no files to correct")
+    files = [name for path, name in documents if path != "-"]
+    if args.in_place and args.output_dir:
+        parser.error("use either --output-dir or --in-place")
+    if files and not (args.in_place or args.output_dir) and len(documents) > 1:
+        parser.error("use --output-dir or --in-place to correct more than one file")
+
+    def output_for(path, name):
+        if path == "-" or not (args.in_place or args.output_dir):
+            return None  # stdout
+        return path if args.in_place else os.path.join(args.output_dir, name)
+
+    manifest_path = args.manifest
+    if manifest_path is None and files and (args.in_place or args.output_dir):
+        manifest_path = os.path.join(args.output_dir or ".", BATCH_MANIFEST)
+
+    BACKEND = args.backend
+    stdout = sys.stdout
+    try:
+        with contextlib.ExitStack() as stack:
+            log = sys.stderr if args.verbose else stack.enter_context(open(os.devnull, "w"))
+            # The app reports what it does with print(); keep that out of corrected text written to stdout
+            stack.enter_context(contextlib.redirect_stdout(log))
+            app = SimpleStupidGrammar(headless=True)
+            corrector = asyncio.run(correct_documents(app, documents, output_for, manifest_path, args, stdout))
+            app.latency.close()
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    except MissingApiKeyError as e:
+        print(f"[ERROR] {str(e)}. Set SSG_API_KEY, run the app once to store a key, or use --backend local",
+              file=sys.stderr)
+        return 1
+    return 1 if corrector.failed else 0
+
+
+def run_server(argv):
+    """Headless API mode: serve the local correction API without Tk, the tray or keyboard hooks"""
+    import argparse
+    import signal
+
+    global BACKEND
+    parser = argparse.ArgumentParser(
+        prog="simple-stupid-grammar --serve",
+        description="Serve the local correction API (POST /v1/correct, POST /v1/correct-batch, GET /v1/stats).",
+    )
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--socket", default=SERVER_SOCKET, help="Listen on this Unix socket instead of host:port")
+    parser.add_argument("--backend", choices=("auto", "gemini", "local"), default=BACKEND)
+    args = parser.parse_args(argv)
+
+    BACKEND = args.backend
+    try:
+        app = SimpleStupidGrammar(headless=True)
+    except MissingApiKeyError as e:
+        print(f"[ERROR] {str(e)}. Set SSG_API_KEY, run the app once to store a key, or use --backend local")
+        return 1
+    if not app.start_server(args.host, args.port, args.socket):
+        return 1
+    # SIGTERM (service managers, kill) shuts down as cleanly as Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: app.shutting_down.set())
+    try:
+        while not app.shutting_down.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    print("Stopping correction API")
+    app.shutting_down.set()
+    app.server.stop()
+    app.engine.stop()
+    if app.warmer_thread:
+        app.warmer_thread.join(timeout=2)
+    app.latency.close()
+    return 0
+
+
+def run_app():
+    """Start the tray app"""
     try:
         app = SimpleStupidGrammar()
         app.run()
@@ -582,3 +4470,18 @@ if __name__ == "__main__":
         traceback.print_exc()
         input("Press Enter to exit...")
         sys.exit(1)
+
+
+def main(argv=None):
+    """Console entry point: the tray app without arguments, the API with --serve, batch correction of files otherwise"""
+    argv = sys.argv[1:] if argv is None else argv
+    if "--serve" in argv:
+        return run_server(argv)
+    if argv:
+        return run_batch(argv)
+    run_app()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Selection capture check for Simple Stupid Grammar on Linux/X11
+Opens a stand-in editor window that owns the PRIMARY selection and has the
+keyboard focus, then checks and times what main.X11Keys does with it:
+reading the highlighted text, falling back to Ctrl+C for a selection that
+was already captured or is too old, typing Ctrl+C with XTest, the hotkey
+state and the focused application's name. Runs on any X server, including a
+virtual one, so it works on CI machines without a desktop.
+
+Usage:
+    xvfb-run -a python measure_selection.py --runs 200
+"""
+
+import argparse
+import select
+import statistics
+import sys
+import threading
+import time
+
+from Xlib import X, XK, Xatom, display
+from Xlib.protocol import event as xevent
+
+import main
+
+
+class SelectionOwner:
+    """A window on its own X connection that owns PRIMARY with known text and records the keys typed into it"""
+
+    def __init__(self, text):
+        self.text = text
+        self.keys = []
+        self.display = display.Display()
+        screen = self.display.screen()
+        self.window = screen.root.create_window(
+            0, 0, 300, 100, 0, screen.root_depth,
+            event_mask=X.KeyPressMask | X.StructureNotifyMask | X.PropertyChangeMask,
+        )
+        self.window.set_wm_class("measure-selection", "MeasureSelection")
+        self.targets = self.display.intern_atom("TARGETS")
+        self.utf8 = self.display.intern_atom("UTF8_STRING")
+        self.timestamp = self.display.intern_atom("TIMESTAMP")
+        self.primary = self.display.intern_atom("PRIMARY")
+        self.window.map()
+        self.wait_for(X.MapNotify)
+        self.window.set_input_focus(X.RevertToParent, X.CurrentTime)
+        self.stamp = None
+        self.selections = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name="SelectionOwner", daemon=True)
+        self.thread.start()
+        self.select()
+
+    def select(self, timeout=5.0):
+        """Highlight the text again: serve() takes PRIMARY at the server time of the property change"""
+        selections = self.selections
+        self.window.change_property(self.timestamp, Xatom.STRING, 8, b"", mode=X.PropModeAppend)
+        self.display.flush()
+        deadline = time.perf_counter() + timeout
+        while self.selections == selections:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("PRIMARY was never taken")
+            time.sleep(0.001)
+
+    def wait_for(self, event_type, timeout=5.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if self.display.next_event().type == event_type:
+                return
+        raise RuntimeError("the window was never mapped")
+
+    def serve(self):
+        while self.running:
+            select.select([self.display], [], [], 0.1)
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if event.type == X.SelectionRequest:
+                    self.answer(event)
+                elif event.type == X.PropertyNotify and event.atom == self.timestamp:
+                    self.window.set_selection_owner(self.primary, event.time)
+                    self.display.sync()
+                    self.stamp = event.time
+                    self.selections += 1
+                elif event.type == X.KeyPress:
+                    keysym = self.display.keycode_to_keysym(event.detail, 0)
+                    self.keys.append(XK.keysym_to_string(keysym) or str(keysym))
+
+    def answer(self, request):
+        """Give the selection to whoever asks, as UTF-8 text"""
+        prop = request.property or request.target
+        if request.target == self.utf8:
+            request.requestor.change_property(prop, self.utf8, 8, self.text.encode("utf-8"))
+        elif request.target == self.timestamp:
+            request.requestor.change_property(prop, Xatom.INTEGER, 32, [self.stamp])
+        elif request.target == self.targets:
+            request.requestor.change_property(prop, Xatom.ATOM, 32, [self.targets, self.utf8, self.timestamp])
+        else:
+            prop = X.NONE
+        notify = xevent.SelectionNotify(time=request.time, requestor=request.requestor,
+                                        selection=request.selection, target=request.target, property=prop)
+        request.requestor.send_event(notify)
+        self.display.flush()
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+        self.window.destroy()
+        self.display.close()
+
+
+def check(label, passed, detail=""):
+    print(f"  {'ok  ' if passed else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    return passed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Check and time X11 selection capture and XTest input")
+    parser.add_argument("--runs", type=int, default=200, help="Selection reads to time")
+    parser.add_argument("--text", default="This are the highlighted text with teh typos.")
+    args = parser.parse_args()
+
+    try:
+        keys = main.X11Keys()
+    except Exception as e:
+        print(f"X11 input unavailable: {e}")
+        sys.exit(2)
+    owner = SelectionOwner(args.text)
+    passed = True
+    try:
+        print("Checks:")
+        passed &= check("PRIMARY selection read", keys.read_selection() == args.text)
+        passed &= check("captured selection falls back to Ctrl+C", keys.read_selection() is None)
+        max_age, main.X11_SELECTION_MAX_AGE = main.X11_SELECTION_MAX_AGE, 0.05
+        keys.last_selection = None
+        time.sleep(0.1)
+        passed &= check("old selection falls back to Ctrl+C", keys.read_selection() is None)
+        main.X11_SELECTION_MAX_AGE = max_age
+        passed &= check("focused application", keys.foreground_app() == "measureselection", keys.foreground_app())
+        passed &= check("hotkey not pressed", not keys.is_pressed(main.KEYBOARD_HOTKEY))
+        keys.send_shortcut("c")
+        deadline = time.perf_counter() + 1.0
+        while len(owner.keys) < 2 and time.perf_counter() < deadline:
+            time.sleep(0.005)
+        passed &= check("Ctrl+C typed with XTest", owner.keys[-2:] == ["Control_L", "c"], " ".join(owner.keys))
+
+        owner.select()
+        times = []
+        for _ in range(args.runs):
+            keys.last_selection = None  # Time fresh highlights, not the fallback
+            started = time.perf_counter()
+            keys.read_selection()
+            times.append((time.perf_counter() - started) * 1000)
+        times.sort()
+        print(f"\nSelection capture over {args.runs} reads:")
+        print(f"  p50 {statistics.median(times):.2f} ms   p95 {times[int(len(times) * 0.95) - 1]:.2f} ms   "
+              f"max {times[-1]:.2f} ms")
+    finally:
+        owner.close()
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
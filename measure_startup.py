@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Startup time measurement for Simple Stupid Grammar
+Reports a `python -X importtime` breakdown of main.py and of each lazily
+imported dependency, then launches the app several times and measures how long
+it takes until the hotkey is registered ("time to hotkey ready").
+
+Usage:
+    python measure_startup.py --runs 5 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import main
+
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+HOTKEY_READY_LINE = re.compile(r"Hotkey ready .* (\d+) ms after start")
+
+
+def import_times(statement):
+    """Run statement under -X importtime; return [(module, self_us, cumulative_us, depth)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            depth = len(match.group(3)) // 2
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2)), depth))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    return rows
+
+
+def lazy_modules():
+    """Names of the modules main.py defers with LazyModule"""
+    return sorted({value._name for value in vars(main).values() if isinstance(value, main.LazyModule)})
+
+
+def measure_imports(top):
+    print("Import time of main.py (deferred modules excluded):")
+    rows = import_times("import main")
+    total = next((cumulative for name, _, cumulative, depth in rows if name == "main"), 0)
+    print(f"  main total: {total / 1000:.1f} ms")
+    for name, self_us, cumulative, depth in sorted(rows, key=lambda row: -row[2])[1:top + 1]:
+        print(f"  {name:<40}{cumulative / 1000:9.1f} ms")
+
+    print("\nCost of each deferred module when it is first used:")
+    deferred = {}
+    for module in lazy_modules():
+        try:
+            rows = import_times(f"import {module}")
+            deferred[module] = next(cumulative for name, _, cumulative, depth in rows if name == module) / 1000
+            print(f"  {module:<40}{deferred[module]:9.1f} ms")
+        except (RuntimeError, StopIteration) as e:
+            deferred[module] = None
+            print(f"  {module:<40}  not importable here ({e})")
+    return {"main_ms": total / 1000, "deferred_ms": deferred}
+
+
+def measure_hotkey_ready(runs, timeout):
+    """Launch the app repeatedly and time until it reports the hotkey as registered"""
+    print(f"\nTime to hotkey ready over {runs} launches:")
+    wall_times = []
+    reported_times = []
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    for run in range(runs):
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "main.py"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        try:
+            deadline = started + timeout
+            for line in process.stdout:
+                match = HOTKEY_READY_LINE.search(line)
+                if match:
+                    wall_times.append((time.perf_counter() - started) * 1000)
+                    reported_times.append(float(match.group(1)))
+                    print(f"  run {run + 1}: {wall_times[-1]:.0f} ms from launch ({match.group(1)} ms after import)")
+                    break
+                if time.perf_counter() > deadline:
+                    print(f"  run {run + 1}: timed out")
+                    break
+            else:
+                print(f"  run {run + 1}: app exited before the hotkey was ready")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    if not wall_times:
+        return None
+    print(f"  median: {statistics.median(wall_times):.0f} ms from launch")
+    return {
+        "runs": wall_times,
+        "median_ms": statistics.median(wall_times),
+        "reported_median_ms": statistics.median(reported_times),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure Simple Stupid Grammar startup time")
+    parser.add_argument("--runs", type=int, default=5, help="App launches for the time-to-hotkey measurement")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for each launch")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--imports-only", action="store_true", help="Skip launching the app")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = {"imports": measure_imports(args.top)}
+    if not args.imports_only:
+        results["hotkey_ready"] = measure_hotkey_ready(args.runs, args.timeout)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
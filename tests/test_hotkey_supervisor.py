@@ -0,0 +1,108 @@
+"""HotkeySupervisor against a fake keyboard module: one hook at a time, one thread, nothing left after close()"""
+
+import random
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class FakeKeyboard:
+    """Stands in for the keyboard module, counting live hooks like its hook thread would"""
+
+    def __init__(self):
+        self.hooks = {}
+        self.added = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def add_hotkey(self, hotkey, callback):
+        with self._lock:
+            self.added += 1
+            handle = object()
+            self.hooks[handle] = (hotkey, callback)
+            self.most = max(self.most, len(self.hooks))
+            return handle
+
+    def remove_hotkey(self, handle):
+        with self._lock:
+            del self.hooks[handle]  # KeyError for an unknown handle, like keyboard
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+@pytest.fixture
+def fake_keyboard(monkeypatch):
+    fake = FakeKeyboard()
+    monkeypatch.setattr(main, "keyboard", fake)
+    return fake
+
+
+def test_start_restart_stop_cycles(fake_keyboard):
+    supervisor = main.HotkeySupervisor("ctrl+alt+g", lambda: None)
+    supervisor.start()
+    assert wait_until(lambda: len(fake_keyboard.hooks) == 1)
+    threads = threading.active_count()
+
+    for _ in range(200):
+        added = fake_keyboard.added
+        supervisor.restart()
+        assert wait_until(lambda: fake_keyboard.added == added + 1 and len(fake_keyboard.hooks) == 1)
+        supervisor.stop()
+        assert wait_until(lambda: not fake_keyboard.hooks)
+        supervisor.start()
+        assert wait_until(lambda: len(fake_keyboard.hooks) == 1)
+        assert threading.active_count() == threads
+
+    assert fake_keyboard.most == 1
+    supervisor.close()
+    assert not fake_keyboard.hooks
+    assert supervisor.thread is None
+    assert threading.active_count() == threads - 1
+
+
+def test_requests_from_many_threads(fake_keyboard):
+    supervisor = main.HotkeySupervisor("ctrl+alt+g", lambda: None)
+    threads = threading.active_count()
+
+    def hammer(seed):
+        rng = random.Random(seed)
+        for _ in range(300):
+            rng.choice((supervisor.start, supervisor.stop, supervisor.restart))()
+
+    workers = [threading.Thread(target=hammer, args=(seed,)) for seed in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    supervisor.start()
+    assert wait_until(lambda: len(fake_keyboard.hooks) == 1)
+    assert fake_keyboard.most == 1
+    assert threading.active_count() == threads + 1  # The supervisor thread and nothing else
+    supervisor.close()
+    assert not fake_keyboard.hooks
+    assert threading.active_count() == threads
+
+
+def test_close_removes_the_hook_and_ignores_later_requests(fake_keyboard):
+    supervisor = main.HotkeySupervisor("ctrl+alt+g", lambda: None)
+    supervisor.start()
+    assert wait_until(lambda: len(fake_keyboard.hooks) == 1)
+    supervisor.close()
+    assert not fake_keyboard.hooks
+
+    supervisor.start()
+    supervisor.restart()
+    time.sleep(0.05)
+    assert not fake_keyboard.hooks
+    assert supervisor.thread is None
@@ -0,0 +1,44 @@
+"""LocalRuleBackend: fixes common mistakes and leaves text that is already correct alone"""
+
+import pytest
+
+import main
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return main.LocalRuleBackend()
+
+
+@pytest.mark.parametrize("text", [
+    "apples, pears, etc. and more",
+    "it was us vs. them",
+    "as shown in fig. three",
+    "about approx. ten minutes",
+    "ask Mr. smith or Dr. jones",
+    "see e.g. the manual, i.e. the first page",
+    "the U.S. is big",
+    "see https://example.com/?q=a,b",
+    "mail me@example.com,thanks",
+    "use snake_case here",
+    "x = a!b",
+    "a,b,c",
+    "as was his wont",
+    "he was in cant and jargon",
+    "this is a partial selection",
+])
+def test_correct_text_is_unchanged(rules, text):
+    assert rules.correct(text) == text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("teh cat adn the dog", "the cat and the dog"),
+    ("hello,world", "hello, world"),
+    ("the the cat sat  on the mat .", "the cat sat on the mat."),
+    ("this is it. the end", "this is it. The end"),
+    ("we use apples etc. the rest is fine. then we stop", "we use apples etc. the rest is fine. Then we stop"),
+    ("i'm sure i can", "I'm sure I can"),
+    ("we dont know", "we don't know"),
+])
+def test_common_mistakes_are_fixed(rules, text, expected):
+    assert rules.correct(text) == expected
@@ -0,0 +1,45 @@
+"""CorrectionServer keep-alive connections: error replies must not leave the request body behind"""
+
+import http.client
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(main, "BACKEND", "local")
+    app = main.SimpleStupidGrammar(headless=True)
+    server = main.CorrectionServer(app, host="127.0.0.1", port=0, token="secret").start()
+    yield server
+    server.stop()
+    app.engine.stop()
+
+
+def request(connection, path, payload, token="secret"):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection.request("POST", path, body=json.dumps(payload), headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_next_request_after_unknown_endpoint(server):
+    connection = http.client.HTTPConnection(*server.httpd.server_address[:2], timeout=5)
+    assert request(connection, "/v1/nothing", {"text": "teh cat"})[0] == 404
+    sock = connection.sock
+    assert request(connection, "/v1/correct", {"text": "teh cat"}) == (200, {"corrected_text": "the cat"})
+    assert connection.sock is sock  # Same keep-alive connection
+    connection.close()
+
+
+def test_next_request_after_wrong_token(server):
+    connection = http.client.HTTPConnection(*server.httpd.server_address[:2], timeout=5)
+    assert request(connection, "/v1/correct", {"text": "teh cat"}, token="wrong")[0] == 401
+    sock = connection.sock
+    assert request(connection, "/v1/correct", {"text": "teh cat"}) == (200, {"corrected_text": "the cat"})
+    assert connection.sock is sock
+    connection.close()
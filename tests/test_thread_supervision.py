@@ -0,0 +1,47 @@
+"""supervise_threads: a dead engine loop is started again, a stopped one is left alone on shutdown"""
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(main, "BACKEND", "local")
+    app = main.SimpleStupidGrammar(headless=True)
+    app.engine.start()
+    yield app
+    app.engine.stop()
+
+
+def kill_engine_loop(engine):
+    """Stop the loop without engine.stop(), as an exception escaping run_forever() would"""
+    thread = engine.thread
+    engine.loop.call_soon_threadsafe(engine.loop.stop)
+    thread.join(timeout=2)
+    assert not thread.is_alive()
+
+
+def test_dead_engine_loop_is_restarted(app):
+    kill_engine_loop(app.engine)
+    app.supervise_threads()
+    assert app.engine.thread.is_alive()
+    assert not app.engine.loop.is_closed()
+    assert app.thread_restarts["correction engine"] == 1
+
+
+def test_restarts_are_limited(app, monkeypatch):
+    monkeypatch.setattr(main, "THREAD_MAX_RESTARTS", 1)
+    kill_engine_loop(app.engine)
+    app.supervise_threads()
+    kill_engine_loop(app.engine)
+    app.supervise_threads()
+    assert not app.engine.thread.is_alive()
+
+
+def test_nothing_is_restarted_while_shutting_down(app):
+    kill_engine_loop(app.engine)
+    app.shutting_down.set()
+    app.supervise_threads()
+    assert not app.engine.thread.is_alive()
+    assert not app.thread_restarts